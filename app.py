@@ -1,29 +1,379 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, get_flashed_messages
+from flask import Blueprint, Flask, Response, current_app, g, has_request_context, render_template, request, redirect, url_for, flash, send_from_directory, jsonify, get_flashed_messages, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+from werkzeug.local import LocalProxy
+from werkzeug.utils import safe_join
+from sqlalchemy import and_, delete, event, func, insert, or_, select, update
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import make_transient_to_detached
 import os
 import random
 import math
+import base64
+import bisect
+import functools
+import gzip
+import hashlib
+import json
+import mimetypes
+import multiprocessing
+import pickle
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from types import MappingProxyType
+
+try:
+    import brotli  # opcional: gera também .br no build-assets
+except ImportError:
+    brotli = None
+
+try:
+    import orjson  # opcional: serialização JSON mais rápida (ver JSON_BACKEND)
+except ImportError:
+    orjson = None
+
+try:
+    from PIL import Image, ImageOps  # opcional: miniaturas WebP das fotos de perfil
+except ImportError:
+    Image = ImageOps = None
 
 # -------------------------
 # Config
 # -------------------------
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('FITPLANNER_SECRET', 'troque_esta_chave_para_producao')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///fitplanner.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
 # Uploads
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')  # criada no primeiro upload
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-login_manager.login_view = "login"
+
+def _config_do_ambiente(app):
+    """Config padrão, lida das variáveis FITPLANNER_*; create_app aplica os overrides por cima."""
+    app.config['SECRET_KEY'] = os.environ.get('FITPLANNER_SECRET', 'troque_esta_chave_para_producao')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('FITPLANNER_DATABASE_URL', 'sqlite:///fitplanner.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # cache: "memory" (LRU por processo: só para um worker, ex.: python app.py) ou "sqlite" (arquivo
+    # local compartilhado entre os workers; o gunicorn.conf.py escolhe este com mais de um worker)
+    app.config['CACHE_BACKEND'] = os.environ.get('FITPLANNER_CACHE_BACKEND', 'memory')
+    app.config['CACHE_PATH'] = os.environ.get('FITPLANNER_CACHE_PATH', os.path.join(app.instance_path, 'cache.db'))
+    app.config['CACHE_MAX_BYTES'] = int(os.environ.get('FITPLANNER_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    # identidade do usuário logado (load_user), invalidada por perfil/trocar_tema
+    app.config['USER_CACHE_MAX'] = int(os.environ.get('FITPLANNER_USER_CACHE_MAX', 10000))
+    app.config['USER_CACHE_TTL'] = int(os.environ.get('FITPLANNER_USER_CACHE_TTL', 60))
+    # limite de perfis por chamada em /api/gerar_planos_lote
+    app.config['MAX_PERFIS_LOTE'] = int(os.environ.get('FITPLANNER_MAX_LOTE', 10000))
+    # cache de planos gerados (chave = perfil normalizado)
+    app.config['PLAN_CACHE_MAX'] = int(os.environ.get('FITPLANNER_PLAN_CACHE_MAX', 4096))
+    app.config['PLAN_CACHE_TTL'] = int(os.environ.get('FITPLANNER_PLAN_CACHE_TTL', 600))
+    # "diff" só grava as linhas que mudaram; "substituir" apaga e reinsere o plano inteiro
+    app.config['MODO_SALVAR_PLANO'] = os.environ.get('FITPLANNER_MODO_SALVAR', 'diff')
+    # planos pré-visualizados aguardando "Salvar" (TTL em segundos)
+    app.config['PREVIEW_MAX'] = int(os.environ.get('FITPLANNER_PREVIEW_MAX', 10000))
+    app.config['PREVIEW_TTL'] = int(os.environ.get('FITPLANNER_PREVIEW_TTL', 900))
+    # loga requisições acima deste tempo (ms) com o SQL executado; 0 desliga
+    app.config['SLOW_REQUEST_MS'] = float(os.environ.get('FITPLANNER_SLOW_MS', 0))
+    app.config['METRICS_TOKEN'] = os.environ.get('FITPLANNER_METRICS_TOKEN')
+    # cache das agregações de /api/treinos_stats por usuário (TTL 0 desliga)
+    app.config['STATS_CACHE_MAX'] = int(os.environ.get('FITPLANNER_STATS_CACHE_MAX', 10000))
+    app.config['STATS_CACHE_TTL'] = int(os.environ.get('FITPLANNER_STATS_CACHE_TTL', 300))
+    # JSON: "auto" usa o orjson se instalado, "stdlib" força o json da biblioteca padrão
+    app.config['JSON_BACKEND'] = os.environ.get('FITPLANNER_JSON_BACKEND', 'auto')
+    # respostas JSON a partir deste tamanho (bytes) saem com gzip/br se o cliente aceitar; 0 desliga
+    app.config['COMPRESSAO_MIN_BYTES'] = int(os.environ.get('FITPLANNER_COMPRESSAO_MIN_BYTES', 1024))
+    app.config['COMPRESSAO_NIVEL_GZIP'] = int(os.environ.get('FITPLANNER_COMPRESSAO_NIVEL_GZIP', 6))
+    app.config['COMPRESSAO_NIVEL_BR'] = int(os.environ.get('FITPLANNER_COMPRESSAO_NIVEL_BR', 5))
+    # modo "otimizar" do gerador: candidatos por perfil, processos do pool e orçamento em ms. O pool é
+    # por worker do gunicorn, então o total de processos é workers x OTIMIZAR_WORKERS (0 = nº de CPUs)
+    app.config['OTIMIZAR_CANDIDATOS'] = int(os.environ.get('FITPLANNER_OTIMIZAR_CANDIDATOS', 64))
+    app.config['OTIMIZAR_WORKERS'] = int(os.environ.get('FITPLANNER_OTIMIZAR_WORKERS', 2))
+    app.config['OTIMIZAR_TEMPO_MS'] = float(os.environ.get('FITPLANNER_OTIMIZAR_TEMPO_MS', 500))
+    # SQLite em arquivo: espera por lock (ms), PRAGMA synchronous, cache de páginas (KiB) e pool de conexões
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('FITPLANNER_SQLITE_BUSY_TIMEOUT_MS', 5000))
+    app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('FITPLANNER_SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+    app.config['SQLITE_CACHE_KB'] = int(os.environ.get('FITPLANNER_SQLITE_CACHE_KB', 16384))
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('FITPLANNER_DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('FITPLANNER_DB_MAX_OVERFLOW', 10))
+    # hash de senha (formato do werkzeug) e o executor que o roda: threads, vagas (rodando + na fila)
+    # e espera máxima; sem vaga a requisição é recusada na hora com 503. Tudo é por processo (um app por
+    # worker): as vagas só limitam algo se o processo atende mais requisições ao mesmo tempo que isso
+    # (o gunicorn.conf.py usa workers gthread e ajusta HASH_FILA_MAX para ficar abaixo do nº de threads)
+    app.config['SENHA_METODO'] = os.environ.get('FITPLANNER_SENHA_METODO', f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}')
+    app.config['SENHA_SALT_LEN'] = int(os.environ.get('FITPLANNER_SENHA_SALT_LEN', 16))
+    app.config['HASH_WORKERS'] = int(os.environ.get('FITPLANNER_HASH_WORKERS', 2))
+    app.config['HASH_FILA_MAX'] = int(os.environ.get('FITPLANNER_HASH_FILA_MAX', 16))
+    app.config['HASH_TIMEOUT_S'] = float(os.environ.get('FITPLANNER_HASH_TIMEOUT_S', 10))
+    # uploads: tamanho máximo da foto; a requisição inteira é cortada um pouco acima disso (413,
+    # MAX_CONTENT_LENGTH, calculado em create_app depois dos overrides)
+    app.config['UPLOAD_MAX_BYTES'] = int(os.environ.get('FITPLANNER_UPLOAD_MAX_BYTES', 8 * 1024 * 1024))
+    # threads que geram as miniaturas (precisa do Pillow)
+    app.config['UPLOAD_WORKERS'] = int(os.environ.get('FITPLANNER_UPLOAD_WORKERS', 2))
+
+
+# -------------------------
+# Engines do banco
+# -------------------------
+def _sqlite_em_arquivo(uri):
+    url = make_url(uri)
+    return url.drivername in {"sqlite", "sqlite+pysqlite"} and url.database not in (None, "", ":memory:")
+
+
+db = SQLAlchemy()
+login_manager = LoginManager()
+login_manager.login_view = "main.login"
+
+# rotas, hooks, globais de template e comandos do CLI; create_app registra em cada app
+bp = Blueprint("main", __name__, cli_group=None)
+
+
+def _configurar_banco(app):
+    """
+    Com SQLite em arquivo: pool de conexões reaproveitadas entre threads, e uma segunda engine
+    ("leitura", mesmo arquivo, query_only) para as rotas que só consultam. Em WAL os leitores não
+    esperam o escritor, e a engine principal fica só com load_user e as gravações.
+    Retorna True se o banco é SQLite em arquivo (e os PRAGMAs devem ser aplicados).
+    """
+    if not _sqlite_em_arquivo(app.config['SQLALCHEMY_DATABASE_URI']):
+        return False
+    if app.config['SQLITE_SYNCHRONOUS'] not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+        raise ValueError("FITPLANNER_SQLITE_SYNCHRONOUS deve ser OFF, NORMAL, FULL ou EXTRA")
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+        "pool_size": app.config['DB_POOL_SIZE'],
+        "max_overflow": app.config['DB_MAX_OVERFLOW'],
+        "connect_args": {"timeout": app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0, "check_same_thread": False},
+    })
+    app.config.setdefault('SQLALCHEMY_BINDS', {"leitura": {"url": app.config['SQLALCHEMY_DATABASE_URI']}})
+    return True
+
+
+def _pragmas_sqlite(config, somente_leitura):
+    # valores lidos aqui: o "connect" do pool não roda necessariamente dentro de um contexto de app
+    busy_timeout_ms = int(config['SQLITE_BUSY_TIMEOUT_MS'])
+    synchronous = config['SQLITE_SYNCHRONOUS']
+    cache_kb = int(config['SQLITE_CACHE_KB'])
+
+    def ao_conectar(dbapi_conn, _registro):
+        cur = dbapi_conn.cursor()
+        cur.execute(f"PRAGMA busy_timeout = {busy_timeout_ms}")
+        if somente_leitura:
+            cur.execute("PRAGMA query_only = ON")
+        else:
+            # WAL fica gravado no arquivo; basta a engine de escrita pedir
+            cur.execute("PRAGMA journal_mode = WAL")
+        cur.execute(f"PRAGMA synchronous = {synchronous}")
+        cur.execute(f"PRAGMA cache_size = -{cache_kb}")
+        cur.execute("PRAGMA temp_store = MEMORY")
+        cur.close()
+    return ao_conectar
+
+
+def ler(stmt):
+    """
+    Executa um SELECT numa conexão da engine de leitura e devolve as linhas (sem a sessão ORM).
+    Sem engine de leitura (ex.: SQLite em memória ou outro banco) usa a sessão normal.
+    """
+    engine = db.engines.get("leitura")
+    if engine is None:
+        return db.session.execute(stmt).all()
+    with engine.connect() as conn:
+        return conn.execute(stmt).all()
+
+
+# -------------------------
+# Estado de cada app
+# -------------------------
+class EstadoApp:
+    """
+    O que pertence ao app (e não ao processo): caches, o mapa (nome, grupo) -> id da tabela
+    exercicio e as vagas do executor de senhas. Fica em app.extensions["fitplanner"].
+    """
+
+    def __init__(self, app):
+        self.caches = {}
+        # (nome, grupo) -> Exercicio.id; o catálogo já é semeado pela migração, então quase sempre é só leitura
+        self.exercicio_ids = {}
+        self.exercicio_ids_lock = threading.Lock()
+        self.vagas_senhas = threading.BoundedSemaphore(app.config['HASH_FILA_MAX'])
+
+
+def _estado():
+    return current_app.extensions["fitplanner"]
+
+
+# -------------------------
+# Métricas (formato texto do Prometheus)
+# -------------------------
+# Os valores são por processo: com vários workers do gunicorn, cada scrape vê um worker.
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BUCKETS_QUERIES = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escapar_label(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, labels=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+        METRICAS.append(self)
+
+    def _rotulos(self, valores, extra=""):
+        pares = [f'{l}="{_escapar_label(v)}"' for l, v in zip(self.labels, valores)]
+        if extra:
+            pares.append(extra)
+        return "{" + ",".join(pares) + "}" if pares else ""
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            series = [(k, list(v) if isinstance(v, list) else v) for k, v in series]
+        linhas += self._linhas(series)
+        return linhas
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, *valores, valor=1):
+        with self._lock:
+            self._series[valores] = self._series.get(valores, 0) + valor
+
+    def _linhas(self, series):
+        return [f"{self.nome}{self._rotulos(k)} {v}" for k, v in series]
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, labels=(), buckets=BUCKETS_LATENCIA):
+        super().__init__(nome, ajuda, labels)
+        self.buckets = buckets
+
+    def observar(self, valor, *valores):
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                # contagem por bucket (não acumulada) + soma + total
+                serie = self._series[valores] = [0] * len(self.buckets) + [0.0, 0]
+            i = bisect.bisect_left(self.buckets, valor)
+            if i < len(self.buckets):
+                serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def _linhas(self, series):
+        linhas = []
+        for k, serie in series:
+            acumulado = 0
+            for limite, n in zip(self.buckets, serie):
+                acumulado += n
+                rotulos = self._rotulos(k, 'le="%s"' % limite)
+                linhas.append(f"{self.nome}_bucket{rotulos} {acumulado}")
+            rotulos = self._rotulos(k, 'le="+Inf"')
+            linhas.append(f"{self.nome}_bucket{rotulos} {serie[-1]}")
+            linhas.append(f"{self.nome}_sum{self._rotulos(k)} {serie[-2]}")
+            linhas.append(f"{self.nome}_count{self._rotulos(k)} {serie[-1]}")
+        return linhas
+
+
+METRICAS = []
+m_requisicoes = Contador("fitplanner_requests_total", "Requisições por endpoint e status.", ("endpoint", "status"))
+m_latencia = Histograma("fitplanner_request_duration_seconds", "Tempo de parede por requisição.", ("endpoint",))
+m_funcao = Histograma("fitplanner_function_duration_seconds", "Tempo dentro de funções instrumentadas (build_plan, load_user...).", ("funcao",))
+m_funcao_req = Contador("fitplanner_function_seconds_total", "Tempo dentro de funções instrumentadas, por endpoint.", ("endpoint", "funcao"))
+m_sql_qtd = Histograma("fitplanner_sql_queries_per_request", "Comandos SQL executados por requisição.", ("endpoint",), BUCKETS_QUERIES)
+m_sql_tempo = Histograma("fitplanner_sql_duration_seconds", "Duração de cada comando SQL.", ("endpoint",))
+m_hash_senha = Histograma("fitplanner_password_hash_seconds", "Tempo de hash/verificação de senha, incluindo a fila.", ("operacao",))
+m_hash_recusados = Contador("fitplanner_password_hash_rejected_total", "Hashes de senha recusados por fila cheia ou espera estourada.", ("operacao",))
+
+
+def medido(nome):
+    """Decorator: registra o tempo da função no histograma e no contexto da requisição atual."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                dt = time.perf_counter() - t0
+                m_funcao.observar(dt, nome)
+                if has_request_context() and "metricas" in g:
+                    g.metricas["funcoes"][nome] = g.metricas["funcoes"].get(nome, 0.0) + dt
+        return wrapper
+    return decorator
+
+
+# o início fica no contexto de execução (um por comando): se o comando falhar, o
+# after_cursor_execute não roda e nada sobra na conexão que volta para o pool
+@event.listens_for(Engine, "before_cursor_execute")
+def _sql_inicio(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metricas_t0 = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _sql_fim(conn, cursor, statement, parameters, context, executemany):
+    t0 = getattr(context, "metricas_t0", None)
+    if t0 is not None and has_request_context() and "metricas" in g:
+        g.metricas["sql"].append((statement, time.perf_counter() - t0))
+
+
+@bp.before_app_request
+def _metricas_inicio():
+    g.metricas = {"t0": time.perf_counter(), "sql": [], "funcoes": {}}
+
+
+@bp.after_app_request
+def _metricas_fim(response):
+    dados = g.pop("metricas", None)
+    if dados is None or request.endpoint == "static":
+        return response
+    dt = time.perf_counter() - dados["t0"]
+    endpoint = request.endpoint or "desconhecido"
+    m_requisicoes.inc(endpoint, response.status_code)
+    m_latencia.observar(dt, endpoint)
+    m_sql_qtd.observar(len(dados["sql"]), endpoint)
+    for _statement, dt_sql in dados["sql"]:
+        m_sql_tempo.observar(dt_sql, endpoint)
+    for nome, dt_funcao in dados["funcoes"].items():
+        m_funcao_req.inc(endpoint, nome, valor=dt_funcao)
+
+    limite_ms = current_app.config['SLOW_REQUEST_MS']
+    if limite_ms and dt * 1000 >= limite_ms:
+        sql = "\n".join(f"  [{dt_sql * 1000:.1f}ms] {' '.join(st.split())}" for st, dt_sql in dados["sql"])
+        current_app.logger.warning("requisição lenta: %s %s (%s) %.1fms, %d SQL, funções=%s\n%s",
+                           request.method, request.path, endpoint, dt * 1000, len(dados["sql"]),
+                           {k: round(v * 1000, 1) for k, v in dados["funcoes"].items()}, sql)
+    return response
+
+
+def exportar_metricas():
+    linhas = []
+    caches = list(_estado().caches.items())
+    for metrica in METRICAS:
+        linhas += metrica.exportar()
+    # contadores dos caches (lidos na hora, cada backend conta os seus)
+    linhas += ["# HELP fitplanner_cache_hits_total Hits por cache.", "# TYPE fitplanner_cache_hits_total counter"]
+    linhas += [f'fitplanner_cache_hits_total{{cache="{nome}"}} {c.hits}' for nome, c in caches]
+    linhas += ["# HELP fitplanner_cache_misses_total Misses por cache.", "# TYPE fitplanner_cache_misses_total counter"]
+    linhas += [f'fitplanner_cache_misses_total{{cache="{nome}"}} {c.misses}' for nome, c in caches]
+    return "\n".join(linhas) + "\n"
 
 
 # -------------------------
@@ -36,161 +386,954 @@ class User(db.Model, UserMixin):
     senha = db.Column(db.String(200), nullable=False)
     foto = db.Column(db.String(200), default=None)
     theme = db.Column(db.String(20), default="dark")  # default dark
+    # incrementada a cada gravação de plano; base do ETag de /api/treinos
+    plano_versao = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+class Exercicio(db.Model):
+    # tabela de consulta: nome/grupo ficam aqui uma vez só, Treino guarda só o id
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(120), nullable=False)
+    grupo_muscular = db.Column(db.String(120), nullable=False, default="")
+    __table_args__ = (db.UniqueConstraint("nome", "grupo_muscular", name="uq_exercicio_nome_grupo"),)
 
 class Treino(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     dias_semana_id = db.Column(db.Integer)
-    grupo_muscular = db.Column(db.String(120))
-    exercicio = db.Column(db.String(120))
+    exercicio_id = db.Column(db.Integer, db.ForeignKey("exercicio.id"))
     series = db.Column(db.Integer)
     repeticoes = db.Column(db.Integer)
+    exercicio_ref = db.relationship(Exercicio, lazy="joined")
+    # todas as consultas filtram por user_id e a maioria ordena por dia
+    __table_args__ = (db.Index("ix_treino_user_dia", "user_id", "dias_semana_id"),)
+
+    @property
+    def exercicio(self):
+        return self.exercicio_ref.nome if self.exercicio_ref else None
+
+    @property
+    def grupo_muscular(self):
+        return self.exercicio_ref.grupo_muscular if self.exercicio_ref else None
+
+
+# campos do usuário que as páginas usam; é isso que fica no user_cache
+USER_CACHE_CAMPOS = ("id", "nome", "email", "foto", "theme")
 
 
 @login_manager.user_loader
+@medido("load_user")
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    uid = int(user_id)
+    campos = user_cache.get(uid)
+    if campos is None:
+        user = db.session.get(User, uid)
+        if user is not None:
+            user_cache.set(uid, {c: getattr(user, c) for c in USER_CACHE_CAMPOS})
+        return user
+    # remonta o User a partir do cache e anexa à sessão sem SELECT; alterações continuam
+    # gerando UPDATE normalmente e campos fora do cache (senha) carregam sob demanda
+    user = User(**campos)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def invalidar_cache_user(user_id):
+    user_cache.delete(int(user_id))
 
 
 # -------------------------
-# Helpers
+# Executores em segundo plano (um por processo, criados sob demanda)
 # -------------------------
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+class PoolPorProcesso:
+    """
+    Executor (threads ou processos) criado na primeira tarefa, e não no import: importar o app
+    não sobe threads. Um pool herdado por fork (ex.: gunicorn --preload) não serve no filho,
+    então cada processo cria o seu, dimensionado pela config do app que pediu a primeira tarefa.
+    """
+
+    def __init__(self, fabrica):
+        self._fabrica = fabrica
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def obter(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = self._fabrica()
+                self._pid = os.getpid()
+            return self._pool
+
+    def submit(self, fn, *args, **kwargs):
+        return self.obter().submit(fn, *args, **kwargs)
+
+    def descartar(self):
+        """Esquece o pool atual (ex.: quebrado); o próximo submit cria outro."""
+        with self._lock:
+            self._pool = None
+
+
+# -------------------------
+# Senhas: hash fora da thread da requisição, com fila limitada
+# -------------------------
+class HashOcupado(Exception):
+    """O executor de senhas está cheio (ou demorou demais); a requisição deve ser recusada."""
+
+
+_pool_senhas = PoolPorProcesso(
+    lambda: ThreadPoolExecutor(max_workers=current_app.config['HASH_WORKERS'], thread_name_prefix="senhas"))
+
+
+def _executar_hash(operacao, fn, *args):
+    # o pbkdf2 do hashlib solta o GIL, então as threads do pool rodam em paralelo de verdade;
+    # o semáforo limita quantos hashes ficam rodando + esperando neste processo, para sempre
+    # sobrarem threads da requisição para as outras rotas
+    vagas = _estado().vagas_senhas
+    if not vagas.acquire(blocking=False):
+        m_hash_recusados.inc(operacao)
+        raise HashOcupado(operacao)
+    inicio = time.perf_counter()
+    try:
+        futuro = _pool_senhas.submit(fn, *args)
+    except BaseException:
+        vagas.release()
+        raise
+    futuro.add_done_callback(lambda _: vagas.release())
+    try:
+        return futuro.result(timeout=current_app.config['HASH_TIMEOUT_S'])
+    except TimeoutError:
+        m_hash_recusados.inc(operacao)
+        raise HashOcupado(operacao) from None
+    finally:
+        m_hash_senha.observar(time.perf_counter() - inicio, operacao)
+
+
+def gerar_hash_senha(senha):
+    """generate_password_hash com o método configurado, rodando no executor de senhas."""
+    return _executar_hash("gerar", generate_password_hash, senha,
+                          current_app.config['SENHA_METODO'], current_app.config['SENHA_SALT_LEN'])
 
 
-def build_plan(nivel, objetivo, divisao, dias, peso, altura, idade):
+def verificar_senha(senha_hash, senha):
+    """check_password_hash rodando no executor de senhas."""
+    return _executar_hash("verificar", check_password_hash, senha_hash, senha)
+
+
+def precisa_rehash(senha_hash):
+    """True se o hash gravado não usa o método/salt configurados hoje (é refeito no próximo login)."""
+    metodo, _, resto = (senha_hash or "").partition("$")
+    salt = resto.partition("$")[0]
+    desejado = current_app.config['SENHA_METODO']
+    if desejado.startswith("pbkdf2:") and desejado.count(":") == 1:
+        desejado += f":{DEFAULT_PBKDF2_ITERATIONS}"
+    return metodo != desejado or len(salt) != current_app.config['SENHA_SALT_LEN']
+
+
+def _hash_ocupado(template):
+    resp = current_app.make_response((render_template(template), 503))
+    resp.headers["Retry-After"] = "5"
+    return resp
+
+
+# -------------------------
+# Cache (backend plugável)
+# -------------------------
+class CacheBackend:
     """
-    Gera um plano semanal (lista de dicts) com treinos mais realistas:
-    - retorna dia como string: "Seg","Ter",...
-    - suporta divisões: livre, abc, abcd, abcde, ppl, upperlower, ppl_ul
-    - alterna Perna A / Perna B quando aplicável
-    Saída: lista de itens {'dia': 'Seg'|'Ter'|..., 'grupo': str, 'exercicio': str, 'series': int, 'repeticoes': int, 'tipo': str, 'progressao': str}
-    """
-    # catálogo de exercícios com tipo, equipamento e dificuldade (1-5)
-    EXS = [
-        # Peito
-        ("Supino reto", "Peito", "composto", "barra/halteres", 4),
-        ("Supino inclinado", "Peito", "composto", "barra/halteres", 4),
-        ("Crucifixo", "Peito", "isolamento", "halteres", 2),
-        ("Flexão de braço", "Peito", "composto", "peso_corpo", 3),
-        ("Fly máquina", "Peito", "isolamento", "máquina", 2),
-
-        # Costas
-        ("Levantamento terra", "Costas", "composto", "barra", 5),
-        ("Puxada alta", "Costas", "composto", "máquina", 4),
-        ("Remada curvada", "Costas", "composto", "barra/halteres", 4),
-        ("Remada baixa", "Costas", "composto", "máquina", 3),
-        ("Barra fixa", "Costas", "composto", "peso_corpo", 4),
-        ("Remada T-bar", "Costas", "composto", "barra", 4),
-        ("Puxada neutra", "Costas", "composto", "máquina", 3),
-        ("Remada unilateral halter", "Costas", "composto", "halteres", 3),
-
-        # Pernas (variedade expandida)
-        ("Agachamento livre", "Pernas", "composto", "barra", 5),
-        ("Agachamento frontal", "Pernas", "composto", "barra", 5),
-        ("Agachamento no Smith", "Pernas", "composto", "smith", 4),
-        ("Leg press 45°", "Pernas", "composto", "máquina", 4),
-        ("Leg press horizontal", "Pernas", "composto", "máquina", 4),
-        ("Hack machine", "Pernas", "composto", "máquina", 4),
-        ("Stiff", "Pernas", "composto", "barra", 4),
-        ("Stiff romeno", "Pernas", "composto", "barra", 4),
-        ("Avanço / Afundo", "Pernas", "composto", "halteres", 3),
-        ("Passada com halteres", "Pernas", "composto", "halteres", 3),
-        ("Agachamento búlgaro", "Pernas", "composto", "halteres", 3),
-        ("Cadeira extensora", "Pernas", "isolamento", "máquina", 2),
-        ("Cadeira flexora", "Pernas", "isolamento", "máquina", 2),
-        ("Mesa flexora", "Pernas", "isolamento", "máquina", 2),
-        ("Panturrilha em pé", "Pernas", "isolamento", "máquina", 2),
-        ("Panturrilha sentado", "Pernas", "isolamento", "máquina", 2),
-        ("Panturrilha no leg press", "Pernas", "isolamento", "máquina", 2),
-        ("Hip thrust", "Pernas", "composto", "barra", 4),
-        ("Elevação pélvica", "Pernas", "isolamento", "banco", 2),
-        ("Glúteo 4 apoios máquina", "Pernas", "isolamento", "máquina", 2),
-        ("Glúteo na polia", "Pernas", "isolamento", "polia", 2),
-        ("Levantamento terra sumô", "Pernas", "composto", "barra", 4),
-        ("Step-up no banco", "Pernas", "composto", "halteres", 3),
-        ("Cadeira adutora", "Pernas", "isolamento", "máquina", 2),
-        ("Cadeira abdutora", "Pernas", "isolamento", "máquina", 2),
-        ("Agachamento hack", "Pernas", "composto", "máquina", 4),
-        ("Avanço no Smith", "Pernas", "composto", "smith", 3),
-
-        # Ombro
-        ("Desenvolvimento militar", "Ombro", "composto", "barra/halteres", 4),
-        ("Elevação lateral", "Ombro", "isolamento", "halteres", 2),
-        ("Elevação frontal", "Ombro", "isolamento", "halteres", 2),
-        ("Remada alta", "Ombro", "composto", "barra", 3),
-
-        # Braços / Bíceps
-        ("Rosca direta", "Bíceps", "isolamento", "barra", 3),
-        ("Rosca alternada", "Bíceps", "isolamento", "halteres", 2),
-        ("Rosca martelo", "Bíceps", "isolamento", "halteres", 2),
-        ("Rosca scott", "Bíceps", "isolamento", "máquina", 2),
-        ("Rosca concentrada", "Bíceps", "isolamento", "halteres", 2),
-
-        # Tríceps
-        ("Tríceps corda", "Tríceps", "isolamento", "polia", 2),
-        ("Paralelas", "Tríceps", "composto", "peso_corpo", 3),
-        ("Tríceps testa", "Tríceps", "isolamento", "barra/halteres", 3),
-
-        # Core / condicionamento
-        ("Prancha", "Core", "isolamento", "peso_corpo", 1),
-        ("Elevação de pernas", "Core", "isolamento", "peso_corpo", 1),
-        ("Farmer's walk (caminhada)", "Core", "composto", "halteres", 2),
-    ]
-
-    # PERNA A e PERNA B blocos (usados para alternar) - nomes coerentes com EXS
-    PERNA_A = [
-        {"grupo":"Pernas","nome":"Agachamento livre","tipo":"composto"},
-        {"grupo":"Pernas","nome":"Leg press 45°","tipo":"composto"},
-        {"grupo":"Pernas","nome":"Hack machine","tipo":"composto"},
-        {"grupo":"Pernas","nome":"Cadeira extensora","tipo":"isolamento"},
-        {"grupo":"Pernas","nome":"Passada com halteres","tipo":"composto"},
-        {"grupo":"Pernas","nome":"Agachamento búlgaro","tipo":"composto"},
-        {"grupo":"Pernas","nome":"Hip thrust","tipo":"composto"},
-        {"grupo":"Pernas","nome":"Step-up no banco","tipo":"composto"},
-    ]
-
-    PERNA_B = [
-        {"grupo":"Pernas","nome":"Stiff romeno","tipo":"composto"},
-        {"grupo":"Pernas","nome":"Stiff","tipo":"composto"},
-        {"grupo":"Pernas","nome":"Mesa flexora","tipo":"isolamento"},
-        {"grupo":"Pernas","nome":"Glúteo 4 apoios máquina","tipo":"isolamento"},
-        {"grupo":"Pernas","nome":"Elevação pélvica","tipo":"isolamento"},
-        {"grupo":"Pernas","nome":"Levantamento terra sumô","tipo":"composto"},
-        {"grupo":"Pernas","nome":"Panturrilha em pé","tipo":"isolamento"},
-        {"grupo":"Pernas","nome":"Panturrilha sentado","tipo":"isolamento"},
-    ]
-
-    # montar dicionário por grupo (do catálogo EXS)
-    grupos = {}
-    for nome, prim, tipo, equip, dif in EXS:
-        grupos.setdefault(prim, []).append({"nome": nome, "tipo": tipo, "dif": dif})
+    Interface comum dos caches: get/set/delete/clear com TTL por chave e contadores de hit/miss.
+    Chaves são tuplas/strings simples; valores precisam ser serializáveis com pickle
+    para funcionar também no backend compartilhado.
+    """
+
+    def __init__(self, nome, maxsize=1024, ttl=300):
+        self.nome = nome
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chave, default=None):
+        raise NotImplementedError
+
+    def set(self, chave, valor, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, chave):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """LRU em memória do processo, com expiração por TTL. Rápido, mas cada worker tem o seu."""
+
+    def __init__(self, nome, maxsize=1024, ttl=300):
+        super().__init__(nome, maxsize, ttl)
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave, default=None):
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._dados[chave]
+                self.misses += 1
+                return default
+            self._dados.move_to_end(chave)
+            self.hits += 1
+            return item[1]
+
+    def set(self, chave, valor, ttl=None):
+        with self._lock:
+            self._dados[chave] = (time.monotonic() + (self.ttl if ttl is None else ttl), valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.maxsize:
+                self._dados.popitem(last=False)
+
+    def delete(self, chave):
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+
+    def __len__(self):
+        return len(self._dados)
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Cache compartilhado entre processos (workers do gunicorn) num arquivo SQLite local em modo WAL.
+    Cada instância é um namespace. Evicção por tamanho (número de itens e bytes) remove
+    primeiro os menos acessados recentemente. Os contadores de hit/miss são do processo.
+    """
+    # só regrava o horário de acesso de um hit depois deste intervalo (evita uma escrita por leitura)
+    TOQUE_INTERVALO = 30
+    # confere os limites de tamanho a cada N escritas
+    CHECAR_A_CADA = 64
+
+    def __init__(self, nome, caminho, maxsize=1024, ttl=300, max_bytes=None):
+        super().__init__(nome, maxsize, ttl)
+        self.caminho = caminho
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._escritas = 0
+
+    def _conn(self):
+        # uma conexão por thread e por processo (após fork, abre outra)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+            conn = sqlite3.connect(self.caminho, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (ns TEXT NOT NULL, chave TEXT NOT NULL, valor BLOB NOT NULL, "
+                "expira REAL NOT NULL, acesso REAL NOT NULL, tamanho INTEGER NOT NULL, PRIMARY KEY (ns, chave))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_ns_acesso ON cache (ns, acesso)")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, chave, default=None):
+        conn = self._conn()
+        agora = time.time()
+        row = conn.execute("SELECT valor, expira, acesso FROM cache WHERE ns = ? AND chave = ?",
+                           (self.nome, repr(chave))).fetchone()
+        if row is None or row[1] < agora:
+            if row is not None:
+                conn.execute("DELETE FROM cache WHERE ns = ? AND chave = ?", (self.nome, repr(chave)))
+            self.misses += 1
+            return default
+        if agora - row[2] > self.TOQUE_INTERVALO:
+            conn.execute("UPDATE cache SET acesso = ? WHERE ns = ? AND chave = ?", (agora, self.nome, repr(chave)))
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, chave, valor, ttl=None):
+        dados = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+        agora = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (ns, chave, valor, expira, acesso, tamanho) VALUES (?, ?, ?, ?, ?, ?)",
+            (self.nome, repr(chave), dados, agora + (self.ttl if ttl is None else ttl), agora, len(dados)),
+        )
+        self._escritas += 1
+        if self._escritas % self.CHECAR_A_CADA == 0:
+            self._evict()
+
+    def _evict(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE ns = ? AND expira < ?", (self.nome, time.time()))
+        itens, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM cache WHERE ns = ?",
+                                    (self.nome,)).fetchone()
+        excesso = max(0, itens - self.maxsize)
+        if self.max_bytes and total > self.max_bytes and itens:
+            # estima quantos itens (pelo tamanho médio) precisam sair para caber no limite
+            excesso = max(excesso, int(math.ceil((total - self.max_bytes) / (total / itens))))
+        if excesso:
+            conn.execute(
+                "DELETE FROM cache WHERE ns = ? AND chave IN "
+                "(SELECT chave FROM cache WHERE ns = ? ORDER BY acesso LIMIT ?)",
+                (self.nome, self.nome, excesso),
+            )
+
+    def delete(self, chave):
+        self._conn().execute("DELETE FROM cache WHERE ns = ? AND chave = ?", (self.nome, repr(chave)))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM cache WHERE ns = ?", (self.nome,))
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache WHERE ns = ?", (self.nome,)).fetchone()[0]
+
+
+def criar_cache(app, nome, maxsize=1024, ttl=300, max_bytes=None, backend=None):
+    """Cria (e registra nos caches do `app`) um cache com o `backend` dado ou, sem ele, o de CACHE_BACKEND."""
+    if (backend or app.config['CACHE_BACKEND']) == "sqlite":
+        cache = SQLiteCache(nome, app.config['CACHE_PATH'], maxsize=maxsize, ttl=ttl,
+                            max_bytes=max_bytes or app.config['CACHE_MAX_BYTES'])
+    else:
+        cache = MemoryCache(nome, maxsize=maxsize, ttl=ttl)
+    app.extensions["fitplanner"].caches[nome] = cache
+    return cache
+
+
+def _criar_caches(app):
+    config = app.config
+    criar_cache(app, "usuarios", maxsize=config['USER_CACHE_MAX'], ttl=config['USER_CACHE_TTL'])
+    criar_cache(app, "planos", maxsize=config['PLAN_CACHE_MAX'], ttl=config['PLAN_CACHE_TTL'])
+    # o "Salvar" pode chegar num worker diferente do que fez o preview: o token tem que valer em
+    # qualquer processo, então fica sempre no SQLite compartilhado, seja qual for o CACHE_BACKEND
+    criar_cache(app, "previews", maxsize=config['PREVIEW_MAX'], ttl=config['PREVIEW_TTL'], backend="sqlite")
+    criar_cache(app, "stats", maxsize=config['STATS_CACHE_MAX'], ttl=config['STATS_CACHE_TTL'])
+
+
+def cache_do_app(nome):
+    """Proxy para o cache `nome` do app atual (cada app de create_app tem os seus)."""
+    return LocalProxy(lambda: _estado().caches[nome])
+
+
+user_cache = cache_do_app("usuarios")
+
+
+# -------------------------
+# Catálogo de exercícios (montado uma vez, no import)
+# -------------------------
+DIAS_LISTA = ("Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom")
+DIA_INDEX = {d: i for i, d in enumerate(DIAS_LISTA)}
+
+# catálogo de exercícios com tipo, equipamento e dificuldade (1-5)
+EXS = (
+    # Peito
+    ("Supino reto", "Peito", "composto", "barra/halteres", 4),
+    ("Supino inclinado", "Peito", "composto", "barra/halteres", 4),
+    ("Crucifixo", "Peito", "isolamento", "halteres", 2),
+    ("Flexão de braço", "Peito", "composto", "peso_corpo", 3),
+    ("Fly máquina", "Peito", "isolamento", "máquina", 2),
+
+    # Costas
+    ("Levantamento terra", "Costas", "composto", "barra", 5),
+    ("Puxada alta", "Costas", "composto", "máquina", 4),
+    ("Remada curvada", "Costas", "composto", "barra/halteres", 4),
+    ("Remada baixa", "Costas", "composto", "máquina", 3),
+    ("Barra fixa", "Costas", "composto", "peso_corpo", 4),
+    ("Remada T-bar", "Costas", "composto", "barra", 4),
+    ("Puxada neutra", "Costas", "composto", "máquina", 3),
+    ("Remada unilateral halter", "Costas", "composto", "halteres", 3),
+
+    # Pernas (variedade expandida)
+    ("Agachamento livre", "Pernas", "composto", "barra", 5),
+    ("Agachamento frontal", "Pernas", "composto", "barra", 5),
+    ("Agachamento no Smith", "Pernas", "composto", "smith", 4),
+    ("Leg press 45°", "Pernas", "composto", "máquina", 4),
+    ("Leg press horizontal", "Pernas", "composto", "máquina", 4),
+    ("Hack machine", "Pernas", "composto", "máquina", 4),
+    ("Stiff", "Pernas", "composto", "barra", 4),
+    ("Stiff romeno", "Pernas", "composto", "barra", 4),
+    ("Avanço / Afundo", "Pernas", "composto", "halteres", 3),
+    ("Passada com halteres", "Pernas", "composto", "halteres", 3),
+    ("Agachamento búlgaro", "Pernas", "composto", "halteres", 3),
+    ("Cadeira extensora", "Pernas", "isolamento", "máquina", 2),
+    ("Cadeira flexora", "Pernas", "isolamento", "máquina", 2),
+    ("Mesa flexora", "Pernas", "isolamento", "máquina", 2),
+    ("Panturrilha em pé", "Pernas", "isolamento", "máquina", 2),
+    ("Panturrilha sentado", "Pernas", "isolamento", "máquina", 2),
+    ("Panturrilha no leg press", "Pernas", "isolamento", "máquina", 2),
+    ("Hip thrust", "Pernas", "composto", "barra", 4),
+    ("Elevação pélvica", "Pernas", "isolamento", "banco", 2),
+    ("Glúteo 4 apoios máquina", "Pernas", "isolamento", "máquina", 2),
+    ("Glúteo na polia", "Pernas", "isolamento", "polia", 2),
+    ("Levantamento terra sumô", "Pernas", "composto", "barra", 4),
+    ("Step-up no banco", "Pernas", "composto", "halteres", 3),
+    ("Cadeira adutora", "Pernas", "isolamento", "máquina", 2),
+    ("Cadeira abdutora", "Pernas", "isolamento", "máquina", 2),
+    ("Agachamento hack", "Pernas", "composto", "máquina", 4),
+    ("Avanço no Smith", "Pernas", "composto", "smith", 3),
+
+    # Ombro
+    ("Desenvolvimento militar", "Ombro", "composto", "barra/halteres", 4),
+    ("Elevação lateral", "Ombro", "isolamento", "halteres", 2),
+    ("Elevação frontal", "Ombro", "isolamento", "halteres", 2),
+    ("Remada alta", "Ombro", "composto", "barra", 3),
+
+    # Braços / Bíceps
+    ("Rosca direta", "Bíceps", "isolamento", "barra", 3),
+    ("Rosca alternada", "Bíceps", "isolamento", "halteres", 2),
+    ("Rosca martelo", "Bíceps", "isolamento", "halteres", 2),
+    ("Rosca scott", "Bíceps", "isolamento", "máquina", 2),
+    ("Rosca concentrada", "Bíceps", "isolamento", "halteres", 2),
+
+    # Tríceps
+    ("Tríceps corda", "Tríceps", "isolamento", "polia", 2),
+    ("Paralelas", "Tríceps", "composto", "peso_corpo", 3),
+    ("Tríceps testa", "Tríceps", "isolamento", "barra/halteres", 3),
+
+    # Core / condicionamento
+    ("Prancha", "Core", "isolamento", "peso_corpo", 1),
+    ("Elevação de pernas", "Core", "isolamento", "peso_corpo", 1),
+    ("Farmer's walk (caminhada)", "Core", "composto", "halteres", 2),
+)
+
+# PERNA A e PERNA B blocos (usados para alternar) - nomes coerentes com EXS
+PERNA_A = (
+    "Agachamento livre", "Leg press 45°", "Hack machine", "Cadeira extensora",
+    "Passada com halteres", "Agachamento búlgaro", "Hip thrust", "Step-up no banco",
+)
+PERNA_B = (
+    "Stiff romeno", "Stiff", "Mesa flexora", "Glúteo 4 apoios máquina",
+    "Elevação pélvica", "Levantamento terra sumô", "Panturrilha em pé", "Panturrilha sentado",
+)
+
+# DIVISAO_MAP (inclui ppl_ul)
+DIVISAO_MAP = MappingProxyType({
+    "livre": None,
+    "abc": (
+        ("Peito", "Tríceps"),
+        ("Costas", "Bíceps"),
+        ("Pernas", "Ombro"),
+    ),
+    "abcd": (
+        ("Peito",),
+        ("Costas",),
+        ("Pernas",),
+        ("Ombro", "Braços"),
+    ),
+    "abcde": (
+        ("Peito",),
+        ("Costas",),
+        ("Pernas",),
+        ("Ombro",),
+        ("Braços",),
+    ),
+    "ppl": (
+        ("Peito", "Ombro", "Tríceps"),
+        ("Costas", "Bíceps"),
+        ("Pernas", "Core"),
+    ),
+    # PPL + Upper/Lower (5 dias)
+    "ppl_ul": (
+        ("Peito", "Ombro", "Tríceps"),                      # Push
+        ("Costas", "Bíceps"),                               # Pull
+        ("Pernas", "Core"),                                 # Legs (A)
+        ("Peito", "Costas", "Ombro", "Bíceps", "Tríceps"),  # Upper
+        ("Pernas", "Core"),                                 # Lower (B)
+    ),
+    "upperlower": (
+        ("Peito", "Costas", "Ombro", "Bíceps", "Tríceps"),  # Upper
+        ("Pernas", "Core"),                                 # Lower
+    ),
+})
+
+# divisões que alternam Perna A / Perna B
+DIVISOES_PERNA_AB = frozenset({"ppl", "upperlower", "ppl_ul"})
+
+# volume alvo semanal por grupo (séries totais)
+VOLUME_ALVO = MappingProxyType({
+    "Peito": (8, 14),
+    "Costas": (8, 14),
+    "Pernas": (10, 18),  # já aumentado
+    "Ombro": (6, 12),
+    "Bíceps": (6, 10),
+    "Tríceps": (6, 10),
+    "Core": (4, 8),
+})
+
+# parâmetros por objetivo: (reps_compound, reps_iso, sets_compound, sets_iso)
+PARAMS_OBJETIVO = MappingProxyType({
+    "forca": ((3, 6), (4, 8), (4, 6), (2, 4)),
+    "emagrecimento": ((8, 15), (12, 20), (3, 4), (2, 3)),
+    "hipertrofia": ((6, 12), (8, 15), (3, 5), (2, 4)),
+})
+
+# multiplicadores por nível
+MULT_POR_NIVEL = MappingProxyType({"iniciante": 0.8, "intermediario": 1.0, "avancado": 1.2})
+
+# mínimo de exercícios por treino de perna para aumentar variedade (opção A)
+MIN_EXS_PER_PERNA = 5
+
+ExercicioDef = namedtuple("ExercicioDef", "id nome grupo tipo equip dif")
+
+
+class Catalogo:
+    """
+    Catálogo imutável de exercícios com índices pré-calculados.
+    Montado uma única vez no import; a geração de planos só consulta os índices.
+    """
+    __slots__ = ("exercicios", "por_nome", "por_grupo", "por_grupo_tipo", "perna_a", "perna_b")
+
+    def __init__(self, exs, perna_a, perna_b):
+        exercicios = tuple(ExercicioDef(i, *row) for i, row in enumerate(exs))
+        por_grupo, por_grupo_tipo = {}, {}
+        for e in exercicios:
+            por_grupo.setdefault(e.grupo, []).append(e)
+            por_grupo_tipo.setdefault((e.grupo, e.tipo), []).append(e)
+        # garantir que "Pernas" possua entrada mesmo que só nos blocos
+        por_grupo.setdefault("Pernas", [])
+
+        por_nome = {e.nome: e for e in exercicios}
+        setattr_ = object.__setattr__
+        setattr_(self, "exercicios", exercicios)
+        setattr_(self, "por_nome", MappingProxyType(por_nome))
+        setattr_(self, "por_grupo", _congelar_indice(por_grupo))
+        setattr_(self, "por_grupo_tipo", _congelar_indice(por_grupo_tipo))
+        setattr_(self, "perna_a", tuple(por_nome[n] for n in perna_a))
+        setattr_(self, "perna_b", tuple(por_nome[n] for n in perna_b))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Catalogo é imutável")
+
+
+def _congelar_indice(indice):
+    return MappingProxyType({k: tuple(v) for k, v in indice.items()})
+
+
+CATALOGO = Catalogo(EXS, PERNA_A, PERNA_B)
+
+# fallback da divisão "livre": 2 grupos por dia, rotacionando
+GRUPOS_LIVRE = tuple(g for g in ("Peito", "Costas", "Pernas", "Ombro", "Bíceps", "Tríceps", "Core")
+                     if g in CATALOGO.por_grupo)
 
-    # garantir que "Pernas" possua entrada mesmo que só nos blocos
-    grupos.setdefault("Pernas", [])
 
+# -------------------------
+# Esqueletos de plano
+# -------------------------
+# A estrutura da semana (dias, grupos de cada dia e séries por aparição) só depende da divisão,
+# dos dias escolhidos e do multiplicador de volume; é calculada uma vez por combinação (ou toda de
+# uma vez em preparar_pre_fork) e o build_plan só sorteia exercícios e reps.
+Esqueleto = namedtuple("Esqueleto", "dias day_patterns series_por_aparicao")
+
+MASCARA_PADRAO = 0b0010101  # Seg/Qua/Sex quando nenhum dia é informado
+
+
+def _montar_esqueleto(divisao, mascara, mult):
+    dias = tuple(i for i in range(len(DIAS_LISTA)) if mascara >> i & 1)
+
+    # mapear dias para padrões (se DIVISAO_MAP definido)
+    pattern = DIVISAO_MAP.get(divisao)
+    if pattern:
+        day_patterns = tuple(pattern[i % len(pattern)] for i in range(len(dias)))
+    else:
+        # fallback: 2 grupos por dia
+        n = len(GRUPOS_LIVRE)
+        day_patterns = tuple((GRUPOS_LIVRE[i % n], GRUPOS_LIVRE[(i + 1) % n]) for i in range(len(dias)))
+
+    # séries por aparição = média do volume alvo dividida pelas aparições do grupo na semana
+    aparicoes = Counter(g for pattern in day_patterns for g in pattern)
+    series_por_aparicao = {}
+    for g, freq in aparicoes.items():
+        alvo = VOLUME_ALVO.get(g, (6, 10))
+        alvo_media = int(round((alvo[0] + alvo[1]) / 2.0))
+        series_por_aparicao[g] = max(2, int(round((alvo_media / max(1, freq)) * mult)))
+    return Esqueleto(dias, day_patterns, series_por_aparicao)
+
+
+# mesma sequência de multiplicações do build_plan, para as chaves baterem bit a bit
+MULTS_ESQUELETO = frozenset(v for m in set(MULT_POR_NIVEL.values()) | {1.0} for v in (m, m * 0.9, m * 0.9 * 0.9))
+
+# (divisao, máscara de dias, mult) -> Esqueleto, preenchida sob demanda: o import não paga pelas
+# ~8000 combinações. Tuplas e dicts de séries iguais são compartilhados entre as entradas.
+ESQUELETOS = {}
+_esqueletos_internados = {}
+
+
+def _registrar_esqueleto(divisao, mascara, mult):
+    esq = _montar_esqueleto(divisao, mascara, mult)
+    series = tuple(sorted(esq.series_por_aparicao.items()))
+    if series not in _esqueletos_internados:
+        _esqueletos_internados[series] = MappingProxyType(esq.series_por_aparicao)
+    esq = Esqueleto(_esqueletos_internados.setdefault(esq.dias, esq.dias),
+                    _esqueletos_internados.setdefault(esq.day_patterns, esq.day_patterns),
+                    _esqueletos_internados[series])
+    ESQUELETOS[(divisao, mascara, mult)] = esq
+    return esq
+
+
+def montar_esqueletos():
+    """
+    Preenche ESQUELETOS para todas as divisões, as 127 máscaras e os multiplicadores possíveis
+    (nível x IMC alto x idade). Chamada antes do fork, para os workers herdarem a tabela pronta.
+    """
+    for divisao in DIVISAO_MAP:
+        for mascara in range(1, 1 << len(DIAS_LISTA)):
+            for mult in MULTS_ESQUELETO:
+                if (divisao, mascara, mult) not in ESQUELETOS:
+                    _registrar_esqueleto(divisao, mascara, mult)
+    return ESQUELETOS
+
+
+def esqueleto_plano(divisao, mascara, mult):
+    """
+    Esqueleto da tabela, montado e registrado na primeira vez que a combinação aparece.
+    Divisões desconhecidas usam o fallback "livre"; máscara 0 usa Seg/Qua/Sex.
+    """
+    if DIVISAO_MAP.get(divisao) is None:
+        divisao = "livre"
+    mascara = mascara or MASCARA_PADRAO
+    esq = ESQUELETOS.get((divisao, mascara, mult))
+    if esq is None:
+        if mult not in MULTS_ESQUELETO:
+            # multiplicador fora da tabela (ex.: MULT_POR_NIVEL alterado em tempo de execução)
+            return _montar_esqueleto(divisao, mascara, mult)
+        esq = _registrar_esqueleto(divisao, mascara, mult)
+    return esq
+
+
+# -------------------------
+# Itens de plano
+# -------------------------
+# texto de progressão por (objetivo, tipo); só séries e reps entram na hora de renderizar
+def _montar_progressoes():
+    textos = {}
+    for objetivo, (reps_compound, reps_iso, _, _) in PARAMS_OBJETIVO.items():
+        for tipo, upper in (("composto", min(reps_compound[1], 15)), ("isolamento", min(reps_iso[1], 20))):
+            if objetivo == "forca":
+                texto = "Foco força: {series}x{repeticoes}. Aumentar carga gradualmente mantendo rep range."
+            elif objetivo == "emagrecimento":
+                texto = "Foco condicionamento: {series}x{repeticoes}. Descansos curtos (~30-60s)."
+            else:
+                texto = f"Hipertrofia: {{series}}x{{repeticoes}}. Aumente 1 rep/semana até {upper}, depois aumente carga."
+            textos[(objetivo, tipo)] = texto
+    return MappingProxyType(textos)
+
+
+PROGRESSOES = _montar_progressoes()
+
+
+class PlanItem:
+    """
+    Item de plano compacto: dia e exercício guardados como índices (DIAS_LISTA / CATALOGO),
+    sem dict por item e sem o texto de progressão, que só é montado quando alguém pede.
+    Continua aceitando acesso de dict (item["exercicio"], item.get("grupo"), dict(item)).
+    """
+    __slots__ = ("dia_idx", "exercicio_id", "series", "repeticoes", "objetivo")
+
+    CAMPOS = ("dia", "grupo", "exercicio", "series", "repeticoes", "tipo", "progressao")
+
+    def __init__(self, dia_idx, exercicio_id, series, repeticoes, objetivo):
+        self.dia_idx = dia_idx
+        self.exercicio_id = exercicio_id
+        self.series = series
+        self.repeticoes = repeticoes
+        self.objetivo = objetivo  # chave de PARAMS_OBJETIVO (string interna, compartilhada)
+
+    @property
+    def dia(self):
+        return DIAS_LISTA[self.dia_idx]
+
+    @property
+    def exercicio(self):
+        return CATALOGO.exercicios[self.exercicio_id].nome
+
+    @property
+    def grupo(self):
+        return CATALOGO.exercicios[self.exercicio_id].grupo
+
+    @property
+    def tipo(self):
+        return CATALOGO.exercicios[self.exercicio_id].tipo
+
+    @property
+    def progressao(self):
+        return PROGRESSOES[(self.objetivo, self.tipo)].format(series=self.series, repeticoes=self.repeticoes)
+
+    # acesso de dict
+    def __getitem__(self, chave):
+        if chave not in self.CAMPOS:
+            raise KeyError(chave)
+        return getattr(self, chave)
+
+    def get(self, chave, padrao=None):
+        return getattr(self, chave) if chave in self.CAMPOS else padrao
+
+    def keys(self):
+        return self.CAMPOS
+
+    def como_dict(self, progressao=False):
+        """Dict para JSON; `progressao` inclui o texto (renderizado agora)."""
+        e = CATALOGO.exercicios[self.exercicio_id]
+        d = {"dia": DIAS_LISTA[self.dia_idx], "grupo": e.grupo, "exercicio": e.nome,
+             "series": self.series, "repeticoes": self.repeticoes, "tipo": e.tipo}
+        if progressao:
+            d["progressao"] = PROGRESSOES[(self.objetivo, e.tipo)].format(series=self.series, repeticoes=self.repeticoes)
+        return d
+
+    def __eq__(self, outro):
+        if not isinstance(outro, PlanItem):
+            return NotImplemented
+        return all(getattr(self, s) == getattr(outro, s) for s in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"PlanItem({self.dia}, {self.exercicio!r}, {self.series}x{self.repeticoes})"
+
+
+def plano_json(plan, progressao=False):
+    """Plano pronto para jsonify; sem `progressao` o provider de JSON serializa os itens direto."""
+    return [item.como_dict(progressao=True) for item in plan] if progressao else plan
+
+
+class FitJSONProvider(DefaultJSONProvider):
+    """
+    JSON do app: serializa PlanItem sem passar por um plano de dicts. Com JSON_BACKEND "auto" e o
+    orjson instalado, usa o orjson; senão (ou se o orjson recusar o objeto, ex.: int de mais de
+    64 bits) cai no json da stdlib. As chaves continuam ordenadas e datas saem como no Flask.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, PlanItem):
+            return o.como_dict()
+        return DefaultJSONProvider.default(o)
+
+    def _usa_orjson(self, kwargs):
+        # argumentos que só o json da stdlib entende (cls, separators...) forçam a stdlib
+        return (orjson is not None and self._app.config['JSON_BACKEND'] == "auto"
+                and kwargs.keys() <= {"default", "sort_keys"})
+
+    def _orjson(self, obj, sort_keys):
+        opcoes = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            opcoes |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=opcoes)
+
+    def dumps(self, obj, **kwargs):
+        if self._usa_orjson(kwargs):
+            try:
+                return self._orjson(obj, kwargs.get("sort_keys", self.sort_keys)).decode()
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if self._usa_orjson(kwargs):
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        # com o orjson, monta o corpo direto em bytes (sem str intermediária)
+        obj = self._prepare_response_obj(args, kwargs)
+        bonito = self.compact is False or (self.compact is None and self._app.debug)
+        if not bonito and self._usa_orjson({}):
+            try:
+                corpo = self._orjson(obj, self.sort_keys)
+            except TypeError:
+                pass
+            else:
+                return self._app.response_class(corpo + b"\n", mimetype=self.mimetype)
+        return super().response(*args, **kwargs)
+
+
+
+# -------------------------
+# Compressão das respostas JSON
+# -------------------------
+def _codificacao_aceita():
+    """"br" ou "gzip", o que o cliente aceitar (br só com o pacote brotli), ou None."""
+    aceitas = request.accept_encodings
+    if brotli is not None and aceitas["br"]:
+        return "br"
+    if aceitas["gzip"]:
+        return "gzip"
+    return None
+
+
+@bp.after_app_request
+def _comprimir_json(response):
+    # só corpos JSON já prontos (não streams nem arquivos) acima do limite; o resto passa direto
+    minimo = current_app.config['COMPRESSAO_MIN_BYTES']
+    if (not minimo or not response.is_json or response.status_code != 200 or response.direct_passthrough
+            or response.is_streamed or "Content-Encoding" in response.headers
+            or (response.content_length or 0) < minimo):
+        return response
+    response.vary.add("Accept-Encoding")
+    codificacao = _codificacao_aceita()
+    if codificacao is None:
+        return response
+    dados = response.get_data()
+    if codificacao == "br":
+        response.set_data(brotli.compress(dados, quality=current_app.config['COMPRESSAO_NIVEL_BR']))
+    else:
+        response.set_data(gzip.compress(dados, compresslevel=current_app.config['COMPRESSAO_NIVEL_GZIP'], mtime=0))
+    response.headers["Content-Encoding"] = codificacao
+    # o corpo comprimido é outra representação: o ETag vira fraco (If-None-Match compara fraco)
+    etag, fraco = response.get_etag()
+    if etag and not fraco:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# -------------------------
+# Motor de seleção de exercícios
+# -------------------------
+# "Braços" numa divisão vira Bíceps + Tríceps na hora de montar o dia
+EXPANSAO_GRUPOS = MappingProxyType({"Braços": ("Bíceps", "Tríceps")})
+
+# blocos de perna já separados por tipo, e o pool de extras de perna com compostos primeiro
+_PERNA_BLOCOS = {
+    True: (CATALOGO.perna_a,
+           tuple(e for e in CATALOGO.perna_a if e.tipo == "composto"),
+           tuple(e for e in CATALOGO.perna_a if e.tipo == "isolamento")),
+    False: (CATALOGO.perna_b,
+            tuple(e for e in CATALOGO.perna_b if e.tipo == "composto"),
+            tuple(e for e in CATALOGO.perna_b if e.tipo == "isolamento")),
+}
+_PERNAS_COMPOSTOS_PRIMEIRO = tuple(sorted(CATALOGO.por_grupo["Pernas"], key=lambda e: 0 if e.tipo == "composto" else 1))
+
+
+def _mascara(exercicios):
+    """Bitmask (int) com o bit de cada ExercicioDef.id ligado (None é ignorado)."""
+    m = 0
+    for e in exercicios:
+        if e is not None:
+            m |= 1 << e.id
+    return m
+
+
+def _series(rng, faixa, mult):
+    return max(1, int(math.ceil(rng.randint(faixa[0], faixa[1]) * mult)))
+
+
+def escolher_exercicios_grupo(rng, grupo, series_necessarias, usados, sets_compound, sets_iso, mult, dif_max=5):
+    """
+    Escolhe exercícios do grupo até cobrir as séries necessárias: compostos primeiro, depois
+    isolamentos, e por fim 1 série de cada restante. `usados` é o bitmask dos exercícios já no plano.
+    Retorna lista de (ExercicioDef, séries).
+    """
+    pool = CATALOGO.por_grupo.get(grupo, ())
+    if not pool:
+        return []
+    chosen = []
+    escolhidos = 0
+    remaining = series_necessarias
+    for tipo, faixa in (("composto", sets_compound), ("isolamento", sets_iso)):
+        for e in CATALOGO.por_grupo_tipo.get((grupo, tipo), ()):
+            if remaining <= 0:
+                break
+            if usados >> e.id & 1 or e.dif > dif_max:
+                continue
+            s = _series(rng, faixa, mult)
+            chosen.append((e, s))
+            escolhidos |= 1 << e.id
+            remaining -= s
+    # fallback se ainda faltar volume
+    if remaining > 0:
+        for e in pool:
+            if remaining <= 0:
+                break
+            if not escolhidos >> e.id & 1:
+                chosen.append((e, 1))
+                remaining -= 1
+    return chosen
+
+
+def escolher_perna(rng, series_necessarias, usar_a, usados, sets_compound, sets_iso, mult):
+    """Escolhe do bloco Perna A ou B garantindo variedade mínima. Retorna lista de (ExercicioDef, séries)."""
+    block, comps, isos = _PERNA_BLOCOS[bool(usar_a)]
+    chosen = []
+    escolhidos = 0
+    remaining = series_necessarias
+
+    # primeiro: compostos do bloco (com cap em séries por exercício composto,
+    # assim abrimos espaço para mais exercícios — opção A)
+    for e in comps:
+        if remaining <= 0:
+            break
+        s = min(_series(rng, sets_compound, mult), 3)
+        chosen.append((e, s))
+        escolhidos |= 1 << e.id
+        remaining -= s
+
+    # depois isolations do bloco
+    for e in isos:
+        if remaining <= 0:
+            break
+        s = _series(rng, sets_iso, mult)
+        chosen.append((e, s))
+        escolhidos |= 1 << e.id
+        remaining -= s
+
+    # se ainda faltar volume, pegar do block (únicos não escolhidos) com 1 série
+    for e in block:
+        if remaining <= 0:
+            break
+        if not escolhidos >> e.id & 1:
+            chosen.append((e, 1))
+            escolhidos |= 1 << e.id
+            remaining -= 1
+
+    # garantir variedade mínima: extras de perna do catálogo ainda não usados nem escolhidos,
+    # e se ainda faltar, do próprio bloco
+    extras_needed = MIN_EXS_PER_PERNA - len(chosen)
+    if extras_needed > 0:
+        indisponiveis = escolhidos | usados
+        for e in _PERNAS_COMPOSTOS_PRIMEIRO:
+            if extras_needed <= 0:
+                break
+            if not indisponiveis >> e.id & 1:
+                chosen.append((e, 1))
+                escolhidos |= 1 << e.id
+                extras_needed -= 1
+        for e in block:
+            if extras_needed <= 0:
+                break
+            if not escolhidos >> e.id & 1:
+                chosen.append((e, 1))
+                escolhidos |= 1 << e.id
+                extras_needed -= 1
+
+    return chosen
+
+
+def _reps(rng, tipo, reps_compound, reps_iso, iniciante):
+    faixa = reps_compound if tipo == "composto" else reps_iso
+    r = rng.randint(faixa[0], faixa[1])
+    # ajustar por nível: iniciantes usam o lado superior do range para aprender técnica
+    if iniciante:
+        r = int(min(r * 1.1, faixa[1]))
+    # garantir ao menos 3 reps e no máximo 20
+    return max(3, min(20, int(r)))
+
+
+def _parametros_perfil(nivel, objetivo, peso, altura, idade):
+    """
+    Parte do perfil que vale para a semana toda:
+    (chave do objetivo em PARAMS_OBJETIVO, (reps_compound, reps_iso, sets_compound, sets_iso), mult, iniciante).
+    """
     # parâmetros por objetivo
     objetivo = (objetivo or "hipertrofia").lower()
-    if objetivo == "forca":
-        reps_compound = (3, 6)
-        reps_iso = (4, 8)
-        sets_compound = (4, 6)
-        sets_iso = (2, 4)
-    elif objetivo == "emagrecimento":
-        reps_compound = (8, 15)
-        reps_iso = (12, 20)
-        sets_compound = (3, 4)
-        sets_iso = (2, 3)
-    else:  # hipertrofia / padrão
-        reps_compound = (6, 12)
-        reps_iso = (8, 15)
-        sets_compound = (3, 5)
-        sets_iso = (2, 4)
+    chave_objetivo = objetivo if objetivo in PARAMS_OBJETIVO else "hipertrofia"
 
     # multiplicadores por nível
     nivel = (nivel or "iniciante").lower()
-    mult_por_nivel = {"iniciante": 0.8, "intermediario": 1.0, "avancado": 1.2}.get(nivel, 1.0)
+    mult_por_nivel = MULT_POR_NIVEL.get(nivel, 1.0)
+    iniciante = nivel == "iniciante"
 
     # ajustar por idade/IMC (reduzir intensidade se necessário)
     try:
@@ -201,310 +1344,1000 @@ def build_plan(nivel, objetivo, divisao, dias, peso, altura, idade):
         mult_por_nivel *= 0.9
     if idade and idade > 55:
         mult_por_nivel *= 0.9
+    return chave_objetivo, PARAMS_OBJETIVO[chave_objetivo], mult_por_nivel, iniciante
 
-    # ----------------------------
-    # DIVISAO_MAP (inclui ppl_ul)
-    # ----------------------------
-    DIVISAO_MAP = {
-        "livre": None,
-
-        "abc": [
-            ["Peito","Tríceps"],
-            ["Costas","Bíceps"],
-            ["Pernas","Ombro"]
-        ],
-
-        "abcd": [
-            ["Peito"],
-            ["Costas"],
-            ["Pernas"],
-            ["Ombro","Braços"]
-        ],
-
-        "abcde": [
-            ["Peito"],
-            ["Costas"],
-            ["Pernas"],
-            ["Ombro"],
-            ["Braços"]
-        ],
-
-        "ppl": [
-            ["Peito","Ombro","Tríceps"],
-            ["Costas","Bíceps"],
-            ["Pernas","Core"]
-        ],
-
-        # PPL + Upper/Lower (5 dias)
-        "ppl_ul": [
-            ["Peito","Ombro","Tríceps"],                     # Push
-            ["Costas","Bíceps"],                             # Pull
-            ["Pernas","Core"],                               # Legs (A)
-            ["Peito","Costas","Ombro","Bíceps","Tríceps"],   # Upper
-            ["Pernas","Core"]                                # Lower (B)
-        ],
-
-        "upperlower": [
-            ["Peito","Costas","Ombro","Bíceps","Tríceps"],   # Upper
-            ["Pernas","Core"]                                # Lower
-        ]
-    }
-
-    def expand_groups(glist):
-        out = []
-        for g in glist:
-            if g == "Braços":
-                out += ["Bíceps", "Tríceps"]
-            else:
-                out.append(g)
-        return out
-
-    # dias de interesse (strings "Seg","Ter",...)
-    dias_lista = ["Seg","Ter","Qua","Qui","Sex","Sáb","Dom"]
-    mapa_dias = [dias_lista.index(d) for d in dias] if dias else [0,2,4]  # padrão Seg/Qua/Sex se não informado
-
-    # volume alvo semanal por grupo (séries totais)
-    volume_alvo = {
-        "Peito": (8, 14),
-        "Costas": (8, 14),
-        "Pernas": (10, 18),  # já aumentado
-        "Ombro": (6, 12),
-        "Bíceps": (6, 10),
-        "Tríceps": (6, 10),
-        "Core": (4, 8)
-    }
-
-    # utilitários
-    used = set()
+
+@medido("build_plan")
+def build_plan(nivel, objetivo, divisao, dias, peso, altura, idade, seed=None):
+    """
+    Gera um plano semanal (lista de dicts) com treinos mais realistas:
+    - retorna dia como string: "Seg","Ter",...
+    - suporta divisões: livre, abc, abcd, abcde, ppl, upperlower, ppl_ul
+    - alterna Perna A / Perna B quando aplicável
+    Usa apenas os índices do CATALOGO (nada é remontado por chamada).
+    Com `seed` a geração é reprodutível (usa um random.Random próprio, sem tocar no global).
+    Saída: lista de PlanItem, que se comporta como {'dia': 'Seg'|'Ter'|..., 'grupo': str, 'exercicio': str, 'series': int, 'repeticoes': int, 'tipo': str, 'progressao': str}
+    """
+    chave_objetivo, params, mult_por_nivel, iniciante = _parametros_perfil(nivel, objetivo, peso, altura, idade)
+    reps_compound, reps_iso, sets_compound, sets_iso = params
+
+    # dias de interesse como máscara de bits: já sai em ordem da semana e sem repetição
+    mascara = 0
+    for d in dias or ():
+        mascara |= 1 << DIA_INDEX[d]
+
+    rng = random.Random(seed) if seed is not None else random
+
+    # estrutura da semana (grupos por dia e séries por aparição) vem da tabela de esqueletos
+    esqueleto = esqueleto_plano(divisao, mascara, mult_por_nivel)
+    series_por_aparicao = esqueleto.series_por_aparicao
+
+    # montar plano dia a dia; os dias já vêm em ordem e, dentro do dia, compostos
+    # entram antes dos isolamentos — o plano sai ordenado sem sort no final
+    alterna_perna = divisao in DIVISOES_PERNA_AB
+    usados = 0
+    perna_toggle = 0
     plan = []
+    for dia_idx, grupos_para_dia in zip(esqueleto.dias, esqueleto.day_patterns):
+        compostos_dia, isolamentos_dia = [], []
+        for grupo_dia in grupos_para_dia:
+            for g in EXPANSAO_GRUPOS.get(grupo_dia, (grupo_dia,)):
+                needed_series = series_por_aparicao.get(g, 3)
+
+                # se for Pernas e divisão pede alternância, use bloco A/B
+                if g == "Pernas" and alterna_perna:
+                    ex_list = escolher_perna(rng, needed_series, perna_toggle % 2 == 0, usados,
+                                             sets_compound, sets_iso, mult_por_nivel)
+                    perna_toggle += 1
+                else:
+                    ex_list = escolher_exercicios_grupo(rng, g, needed_series, usados,
+                                                        sets_compound, sets_iso, mult_por_nivel)
+
+                # compostos primeiro; evitar repetir o mesmo exercício na mesma semana
+                for tipo, destino in (("composto", compostos_dia), ("isolamento", isolamentos_dia)):
+                    for e, series in ex_list:
+                        if e.tipo != tipo or usados >> e.id & 1:
+                            continue
+                        usados |= 1 << e.id
+                        repeticoes = _reps(rng, tipo, reps_compound, reps_iso, iniciante)
+                        destino.append(PlanItem(dia_idx, e.id, int(series), int(repeticoes), chave_objetivo))
+        plan += compostos_dia
+        plan += isolamentos_dia
 
-    def rand_range(r):
-        return random.randint(r[0], r[1])
-
-    # mínimo de exercícios por treino de perna para aumentar variedade (opção A)
-    MIN_EXS_PER_PERNA = 5
-
-    def choose_exercises_for_group(group, needed_series, prefer_dif_max=5):
-        """Retorna lista de exercícios para o grupo com contagem de séries por exercício."""
-        pool = grupos.get(group, [])[:]
-        if not pool:
-            return []
-        # priorizar compostos
-        compounds = [e for e in pool if e["tipo"] == "composto" and e["nome"] not in used and e["dif"] <= prefer_dif_max]
-        isolations = [e for e in pool if e["tipo"] == "isolamento" and e["nome"] not in used and e["dif"] <= prefer_dif_max]
-        chosen = []
-        remaining = needed_series
-        # tentar alocar compostos primeiro
-        for e in compounds:
-            if remaining <= 0:
-                break
-            s = rand_range(sets_compound)
-            s = max(1, int(math.ceil(s * mult_por_nivel)))
-            chosen.append({"nome": e["nome"], "tipo": "composto", "series": s})
-            remaining -= s
-        # preencher com isolations
-        for e in isolations:
-            if remaining <= 0:
-                break
-            s = rand_range(sets_iso)
-            s = max(1, int(math.ceil(s * mult_por_nivel)))
-            chosen.append({"nome": e["nome"], "tipo": "isolamento", "series": s})
-            remaining -= s
-        # fallback se ainda faltar volume
-        if remaining > 0:
-            fallback = [e for e in pool if e["nome"] not in [c["nome"] for c in chosen]]
-            i = 0
-            while remaining > 0 and (i < len(fallback)):
-                e = fallback[i]
-                s = 1
-                chosen.append({"nome": e["nome"], "tipo": e.get("tipo", "isolamento"), "series": s})
-                remaining -= s
-                i += 1
-        return chosen
-
-    # escolha específica para Pernas (usa PERNA_A / PERNA_B alternando)
-    def choose_perna_for_block(needed_series, use_a=True):
-        """Retorna lista de {nome,tipo,series} escolhidos do bloco A ou B garantindo variedade mínima."""
-        block = PERNA_A if use_a else PERNA_B
-        chosen = []
-        remaining = needed_series
-
-        # priorizar compostos do bloco (mas limitar séries por composto para aumentar nº de exercícios)
-        comps = [e for e in block if e["tipo"] == "composto"]
-        isos = [e for e in block if e["tipo"] == "isolamento"]
-
-        # primeiro: compostos do bloco (com cap em séries por exercício composto)
-        for e in comps:
-            if remaining <= 0:
-                break
-            s = max(1, int(math.ceil(rand_range(sets_compound) * mult_por_nivel)))
-            # cap para pernas: não deixe compostos terem muitas séries individuais,
-            # assim abrimos espaço para mais exercícios (opção A)
-            s = min(s, 3)
-            chosen.append({"nome": e["nome"], "tipo": "composto", "series": s})
-            remaining -= s
+    return plan
 
-        # depois isolations do bloco
-        for e in isos:
-            if remaining <= 0:
-                break
-            s = max(1, int(math.ceil(rand_range(sets_iso) * mult_por_nivel)))
-            chosen.append({"nome": e["nome"], "tipo": "isolamento", "series": s})
-            remaining -= s
 
-        # se ainda faltar volume, pegar do block (únicos não escolhidos) com 1 série
-        i = 0
-        while remaining > 0 and i < len(block):
-            e = block[i]
-            if e["nome"] not in [c["nome"] for c in chosen]:
-                chosen.append({"nome": e["nome"], "tipo": e["tipo"], "series": 1})
-                remaining -= 1
-            i += 1
-
-        # garantir variedade mínima de exercícios -> se escolhido < MIN_EXS_PER_PERNA, adicionar extras do catálogo
-        if len(chosen) < MIN_EXS_PER_PERNA:
-            extras_needed = MIN_EXS_PER_PERNA - len(chosen)
-            # busca por exercícios de pernas no catálogo que ainda não foram usados nem escolhidos
-            pool = [e for e in grupos.get("Pernas", []) if e["nome"] not in [c["nome"] for c in chosen] and e["nome"] not in used]
-            # ordenar para preferir compostos
-            pool = sorted(pool, key=lambda x: 0 if x["tipo"] == "composto" else 1)
-            j = 0
-            while extras_needed > 0 and j < len(pool):
-                e = pool[j]
-                s = 1  # acrescenta 1 série por exercício extra para variedade
-                chosen.append({"nome": e["nome"], "tipo": e["tipo"], "series": s})
-                extras_needed -= 1
-                j += 1
-            # se ainda falta, pegar repetidos do block (pode repetir se necessario)
-            k = 0
-            while extras_needed > 0 and k < len(block):
-                e = block[k]
-                if e["nome"] not in [c["nome"] for c in chosen]:
-                    chosen.append({"nome": e["nome"], "tipo": e["tipo"], "series": 1})
-                    extras_needed -= 1
-                k += 1
-
-        return chosen
-
-    # função que formata objetivo de reps por tipo de exercício
-    def reps_for(tipo):
-        if tipo == "composto":
-            r = rand_range(reps_compound)
+# -------------------------
+# Helpers
+# -------------------------
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+# -------------------------
+# Uploads de foto: gravação em blocos, dedupe por hash e miniaturas em segundo plano
+# -------------------------
+MINIATURAS = (96, 256)  # lados (px) das variantes WebP
+_BLOCO_UPLOAD = 64 * 1024
+_ASSINATURAS = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a")
+_pool_imagens = PoolPorProcesso(
+    lambda: ThreadPoolExecutor(max_workers=current_app.config['UPLOAD_WORKERS'], thread_name_prefix="miniaturas"))
+
+
+def guardar_upload(arquivo):
+    """
+    Grava o upload em UPLOAD_FOLDER lendo em blocos (sem carregar tudo na memória), com limite
+    de UPLOAD_MAX_BYTES. O nome final é o sha256 do conteúdo, então fotos repetidas viram um
+    arquivo só. Agenda as miniaturas e devolve o nome. Levanta ValueError se a foto for inválida.
+    """
+    ext = arquivo.filename.rsplit('.', 1)[1].lower()
+    limite = current_app.config['UPLOAD_MAX_BYTES']
+    digest = hashlib.sha256()
+    tamanho = 0
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    temporario = os.path.join(UPLOAD_FOLDER, f".upload-{secrets.token_hex(8)}")
+    try:
+        with open(temporario, "wb") as f:
+            while True:
+                bloco = arquivo.stream.read(_BLOCO_UPLOAD)
+                if not bloco:
+                    break
+                if tamanho == 0 and not bloco.startswith(_ASSINATURAS):
+                    raise ValueError("O arquivo não é uma imagem PNG, JPEG ou GIF.")
+                tamanho += len(bloco)
+                if tamanho > limite:
+                    raise ValueError(f"A foto deve ter no máximo {limite // (1024 * 1024)} MB.")
+                digest.update(bloco)
+                f.write(bloco)
+        if tamanho == 0:
+            raise ValueError("Arquivo vazio.")
+        nome = f"{digest.hexdigest()[:32]}.{'jpg' if ext == 'jpeg' else ext}"
+        destino = os.path.join(UPLOAD_FOLDER, nome)
+        if os.path.exists(destino):
+            os.remove(temporario)
         else:
-            r = rand_range(reps_iso)
-        # ajustar por nível: iniciantes usam o lado superior do range para aprender técnica
-        if nivel == "iniciante":
-            r = int(min(r * 1.1, (reps_compound[1] if tipo == "composto" else reps_iso[1])))
-        # garantir ao menos 3 reps e no máximo 20
-        return max(3, min(20, int(r)))
+            os.replace(temporario, destino)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+    if Image is not None:
+        _pool_imagens.submit(gerar_miniaturas, nome, current_app.logger)
+    return nome
 
-    # mapear dias para padrões (se DIVISAO_MAP definido)
-    if DIVISAO_MAP.get(divisao):
-        pattern = DIVISAO_MAP.get(divisao)
-        pattern_len = len(pattern)
-        day_patterns = []
-        for i, dia in enumerate(mapa_dias):
-            day_patterns.append(pattern[i % pattern_len])
+
+def _nome_miniatura(nome, lado):
+    return f"{nome.rsplit('.', 1)[0]}.{lado}.webp"
+
+
+def gerar_miniaturas(nome, logger):
+    """
+    Gera as variantes WebP de MINIATURAS para a foto (as que já existem são puladas).
+    Roda numa thread do pool, sem contexto de app: as falhas vão para o `logger` recebido.
+    """
+    origem = os.path.join(UPLOAD_FOLDER, nome)
+    faltando = [lado for lado in MINIATURAS
+                if not os.path.exists(os.path.join(UPLOAD_FOLDER, _nome_miniatura(nome, lado)))]
+    if not faltando or Image is None:
+        return
+    try:
+        with Image.open(origem) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+            for lado in sorted(faltando, reverse=True):
+                miniatura = img.copy()
+                miniatura.thumbnail((lado, lado))
+                destino = os.path.join(UPLOAD_FOLDER, _nome_miniatura(nome, lado))
+                temporario = f"{destino}.{secrets.token_hex(4)}.tmp"
+                miniatura.save(temporario, "WEBP", quality=80, method=4)
+                os.replace(temporario, destino)
+    except Exception:
+        logger.exception("falha ao gerar miniaturas de %s", nome)
+
+
+@bp.app_template_global()
+def foto_url(foto, lado=MINIATURAS[-1]):
+    """URL da foto de perfil; uploaded_file entrega a miniatura WebP de `lado` px quando existir."""
+    return url_for('main.uploaded_file', filename=foto, tam=lado)
+
+
+PERFIL_CAMPOS = ("nivel", "objetivo", "divisao", "dias", "peso", "altura", "idade")
+
+
+def _numero(valor, tipo):
+    try:
+        return tipo(valor or 0)
+    except (TypeError, ValueError):
+        return tipo(0)
+
+
+def _perfil_do_form(form):
+    """Lê os campos do formulário do gerador na ordem de PERFIL_CAMPOS."""
+    return (
+        form.get("nivel", "iniciante"),
+        form.get("objetivo", "hipertrofia"),
+        form.get("divisao", "livre"),
+        [d for d in form.getlist("dias") if d in DIA_INDEX],
+        _numero(form.get("peso"), float),
+        _numero(form.get("altura"), float),
+        _numero(form.get("idade"), int),
+    )
+
+
+def normalizar_perfil(perfil):
+    """
+    Converte um perfil (lista/tupla na ordem de PERFIL_CAMPOS ou dict com essas chaves)
+    nos argumentos de build_plan. Levanta ValueError se o perfil for inválido.
+    """
+    if isinstance(perfil, dict):
+        perfil = [perfil.get(c) for c in PERFIL_CAMPOS]
+    if not isinstance(perfil, (list, tuple)) or len(perfil) != len(PERFIL_CAMPOS):
+        raise ValueError("perfil deve ter os campos: " + ", ".join(PERFIL_CAMPOS))
+    nivel, objetivo, divisao, dias, peso, altura, idade = perfil
+    for campo, valor in (("nivel", nivel), ("objetivo", objetivo), ("divisao", divisao)):
+        if valor is not None and not isinstance(valor, str):
+            raise ValueError(f"{campo} deve ser texto")
+    if isinstance(dias, str) or not isinstance(dias, (list, tuple, type(None))):
+        raise ValueError("dias deve ser uma lista")
+    dias = tuple(dias or ())
+    # itens que não são texto (listas, dicts vindos do JSON) são dias inválidos, não erro 500
+    invalidos = [d for d in dias if not isinstance(d, str) or d not in DIA_INDEX]
+    if invalidos:
+        raise ValueError(f"dias inválidos: {invalidos}")
+    return (nivel or "iniciante", objetivo or "hipertrofia", divisao or "livre", dias,
+            _numero(peso, float), _numero(altura, float), _numero(idade, int))
+
+
+def chave_perfil(nivel, objetivo, divisao, dias, peso, altura, idade):
+    """
+    Chave com apenas o que build_plan realmente usa do perfil:
+    peso/altura/idade só contam pelos limiares de IMC (> 32) e idade (> 55).
+    """
+    try:
+        imc = peso / (altura ** 2) if altura and altura > 0 else None
+    except:
+        imc = None
+    imc_alto = bool(imc and imc > 32)
+    return ((nivel or "iniciante").lower(), (objetivo or "hipertrofia").lower(), divisao,
+            tuple(sorted(set(dias or ()), key=DIA_INDEX.__getitem__)), imc_alto, bool(idade and idade > 55))
+
+
+def plan_seed(chave):
+    """Seed estável entre processos (não usa hash(), que muda a cada execução do Python)."""
+    digest = hashlib.blake2b(repr(chave).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+plan_cache = cache_do_app("planos")
+
+
+def plano_cacheado(perfil):
+    """
+    build_plan com seed derivada do perfil normalizado, servido do plan_cache.
+    Como o plano é função só da chave, perfis iguais (de qualquer usuário) recebem o mesmo plano.
+    O plano devolvido é compartilhado: não altere a lista nem os itens.
+    """
+    chave = chave_perfil(*perfil)
+    plan = plan_cache.get(chave)
+    if plan is None:
+        plan = build_plan(*perfil, seed=plan_seed(chave))
+        plan_cache.set(chave, plan)
+    return plan
+
+
+def build_plans(batch, max_distintos=1024):
+    """
+    Gera um plano por perfil do lote, na ordem de entrada (é um gerador).
+    Perfis equivalentes para build_plan são gerados uma vez só; só os `max_distintos`
+    perfis mais recentes ficam em memória, então lotes grandes podem ser consumidos em streaming.
+    """
+    gerados = OrderedDict()
+    for perfil in batch:
+        args = normalizar_perfil(perfil)
+        chave = chave_perfil(*args)
+        plan = gerados.get(chave)
+        if plan is None:
+            plan = gerados[chave] = plano_cacheado(args)
+            if len(gerados) > max_distintos:
+                gerados.popitem(last=False)
+        else:
+            gerados.move_to_end(chave)
+        yield plan
+
+
+# -------------------------
+# Otimizador: vários candidatos por perfil num pool de processos
+# -------------------------
+# peso de cada critério na nota do plano
+PESOS_PONTUACAO = MappingProxyType({"volume": 1.0, "equilibrio": 0.5, "variedade": 0.25})
+
+
+def pontuar_plano(plan):
+    """
+    Nota de um plano (maior = melhor):
+    - volume: séries semanais de cada grupo fora da faixa do VOLUME_ALVO (penaliza)
+    - equilíbrio: dispersão entre os grupos do volume relativo ao meio da faixa (penaliza)
+    - variedade: exercícios distintos por aparição do grupo, até 2 por aparição (bonifica)
+    """
+    if not plan:
+        return float("-inf")
+    volume, exercicios, dias = Counter(), Counter(), {}
+    for item in plan:
+        volume[item["grupo"]] += item["series"]
+        exercicios[item["grupo"]] += 1
+        dias.setdefault(item["grupo"], set()).add(item["dia"])
+
+    fora, razoes, variedade = 0.0, [], 0.0
+    for grupo, series in volume.items():
+        lo, hi = VOLUME_ALVO.get(grupo, (6, 10))
+        fora += (max(0, lo - series) + max(0, series - hi)) / hi
+        razoes.append(series / ((lo + hi) / 2.0))
+        variedade += min(1.0, exercicios[grupo] / (2.0 * len(dias[grupo])))
+    media = sum(razoes) / len(razoes)
+    desequilibrio = math.sqrt(sum((r - media) ** 2 for r in razoes) / len(razoes))
+    return (PESOS_PONTUACAO["variedade"] * variedade / len(volume)
+            - PESOS_PONTUACAO["volume"] * fora
+            - PESOS_PONTUACAO["equilibrio"] * desequilibrio)
+
+
+def _melhor_candidato(perfil, seeds):
+    """Roda num processo do pool: gera os candidatos e devolve só (nota, seed) do melhor."""
+    return max((pontuar_plano(build_plan(*perfil, seed=seed)), seed) for seed in seeds)
+
+
+def _novo_pool_otimizador():
+    # forkserver (ou spawn): os processos do pool não nascem por fork de um worker que já tem
+    # threads rodando (senhas, miniaturas); o servidor de fork importa o app uma vez e cada
+    # processo do pool sai dele já com o catálogo carregado
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        contexto = multiprocessing.get_context("forkserver")
+        contexto.set_forkserver_preload(["__main__", __name__])
     else:
-        # fallback: 2 grupos por dia
-        all_groups = [g for g in ["Peito","Costas","Pernas","Ombro","Bíceps","Tríceps","Core"] if g in grupos]
-        day_patterns = []
-        for i in range(len(mapa_dias)):
-            g1 = all_groups[i % len(all_groups)]
-            g2 = all_groups[(i+1) % len(all_groups)]
-            day_patterns.append([g1, g2])
-
-    # calcular aparições por grupo
-    aparicoes = {}
-    for pattern in day_patterns:
-        for g in pattern:
-            aparicoes[g] = aparicoes.get(g, 0) + 1
-
-    # decidir séries por aparição
-    series_por_aparicao = {}
-    for g, freq in aparicoes.items():
-        alvo = volume_alvo.get(g, (6, 10))
-        alvo_media = int(round((alvo[0] + alvo[1]) / 2.0))
-        per_day = max(2, int(round((alvo_media / max(1, freq)) * mult_por_nivel)))
-        series_por_aparicao[g] = per_day
+        contexto = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=current_app.config['OTIMIZAR_WORKERS'] or None, mp_context=contexto)
 
-    # montar plano dia a dia
-    perna_toggle = 0
-    for dia_idx, grupos_para_dia in zip(mapa_dias, day_patterns):
-        expanded = []
-        for g in grupos_para_dia:
-            if g == "Braços":
-                expanded += ["Bíceps", "Tríceps"]
-            else:
-                expanded.append(g)
 
-        for g in expanded:
-            needed_series = series_por_aparicao.get(g, 3)
+_pool_otimizador = PoolPorProcesso(_novo_pool_otimizador)
 
-            # se for Pernas e divisão pede alternância, use bloco A/B
-            if g == "Pernas" and divisao in ("ppl", "upperlower", "ppl_ul"):
-                use_a = (perna_toggle % 2 == 0)
-                perna_choices = choose_perna_for_block(needed_series, use_a=use_a)
-                perna_toggle += 1
-                ex_list = perna_choices
-            else:
-                ex_list = choose_exercises_for_group(g, needed_series)
 
-            if not ex_list:
+@medido("otimizar_plano")
+def otimizar_plano(perfil, candidatos=None, tempo_ms=None):
+    """
+    Gera `candidatos` planos para o perfil (seeds derivadas da chave) espalhados pelo pool de
+    processos e devolve o de melhor nota. Espera no máximo `tempo_ms`: o que não terminou é
+    cancelado e vence o melhor entre os prontos. O plano padrão (plano_cacheado) sempre concorre,
+    então o resultado nunca é pior que o do modo normal. Só resultados completos vão pro plan_cache.
+    """
+    candidatos = candidatos or current_app.config['OTIMIZAR_CANDIDATOS']
+    tempo_ms = current_app.config['OTIMIZAR_TEMPO_MS'] if tempo_ms is None else tempo_ms
+    chave = chave_perfil(*perfil)
+    plan = plan_cache.get(("otimizado", chave))
+    if plan is not None:
+        return plan
+
+    padrao = plano_cacheado(perfil)
+    base = plan_seed(chave)
+    melhor = (pontuar_plano(padrao), base)
+    seeds = [base + i for i in range(1, candidatos)]
+    # blocos pequenos: com orçamento curto ainda sobram blocos prontos para comparar, e um bloco
+    # já em execução quando o tempo estoura (não dá pra cancelar) desperdiça pouco
+    pool = _pool_otimizador.obter()
+    tamanho = max(1, min(16, len(seeds) // ((current_app.config['OTIMIZAR_WORKERS'] or os.cpu_count() or 1) * 4)))
+    try:
+        futuros = [pool.submit(_melhor_candidato, perfil, seeds[i:i + tamanho])
+                   for i in range(0, len(seeds), tamanho)]
+    except BrokenProcessPool:
+        _pool_otimizador.descartar()
+        return padrao
+    prontos, pendentes = wait(futuros, timeout=tempo_ms / 1000.0)
+    for futuro in pendentes:
+        futuro.cancel()
+    for futuro in prontos:
+        if futuro.exception() is None:
+            melhor = max(melhor, futuro.result())
+        elif isinstance(futuro.exception(), BrokenProcessPool):
+            _pool_otimizador.descartar()
+
+    plan = padrao if melhor[1] == base else build_plan(*perfil, seed=melhor[1])
+    if not pendentes:
+        plan_cache.set(("otimizado", chave), plan)
+    return plan
+
+
+# -------------------------
+# Pré-visualizações pendentes (preview -> confirmar)
+# -------------------------
+# sempre no SQLite compartilhado (ver _criar_caches): o "Salvar" pode chegar em outro worker
+preview_cache = cache_do_app("previews")
+
+
+def guardar_preview(user_id, plan):
+    """Guarda o plano mostrado na pré-visualização e devolve o token para confirmá-lo."""
+    token = secrets.token_urlsafe(16)
+    preview_cache.set(token, (user_id, plan))
+    return token
+
+
+def retirar_preview(user_id, token):
+    """Plano guardado para o token (uso único), ou None se expirou ou é de outro usuário."""
+    item = preview_cache.get(token) if token else None
+    if item is None or item[0] != user_id:
+        return None
+    preview_cache.delete(token)
+    return item[1]
+
+
+# -------------------------
+# Persistência de planos
+# -------------------------
+def _dia_para_indice(dia_val):
+    """Converte o dia do item ("Seg".. ou "0".."6"/int) para índice 0..6."""
+    if isinstance(dia_val, str) and dia_val in DIA_INDEX:
+        return DIA_INDEX[dia_val]
+    try:
+        return int(dia_val) % 7
+    except (TypeError, ValueError):
+        return 0
+
+
+def exercicio_ids(pares):
+    """
+    Resolve pares (nome, grupo) para ids da tabela exercicio, criando os que faltarem
+    (na transação corrente). Retorna um dict {(nome, grupo): id}.
+    """
+    estado = _estado()
+    faltando = {p for p in pares if p not in estado.exercicio_ids}
+    if faltando:
+        valores = [{"nome": n, "grupo_muscular": g} for n, g in faltando]
+        db.session.execute(sqlite_insert(Exercicio).on_conflict_do_nothing(), valores)
+        rows = db.session.execute(
+            select(Exercicio.id, Exercicio.nome, Exercicio.grupo_muscular)
+            .where(Exercicio.nome.in_({n for n, _ in faltando}))
+        )
+        with estado.exercicio_ids_lock:
+            for row in rows:
+                estado.exercicio_ids[(row.nome, row.grupo_muscular)] = row.id
+    return {p: estado.exercicio_ids[p] for p in pares}
+
+
+def _linhas_treino(user_id, plan):
+    pares = [(item.get('exercicio'), item.get('grupo') or "") for item in plan]
+    ids = exercicio_ids(set(pares))
+    return [{
+        "user_id": user_id,
+        "dias_semana_id": _dia_para_indice(item.get('dia')),
+        "exercicio_id": ids[par],
+        "series": int(item.get('series', 0)),
+        "repeticoes": int(item.get('repeticoes', 0)),
+    } for item, par in zip(plan, pares)]
+
+
+def _gravar_alteracoes(user_id, inserir=(), atualizar=(), remover=(), substituir=False):
+    """
+    Aplica alterações nos treinos do usuário e faz commit: apaga `remover` (ids), atualiza
+    `atualizar` (dicts com "id", num único executemany) e insere `inserir`. Com `substituir`,
+    apaga todos os treinos do usuário antes. Se algo mudou, incrementa User.plano_versao na
+    mesma transação (os caches derivados dos treinos são chaveados por ela).
+    Retorna um dict com a contagem de linhas inseridas, atualizadas e removidas.
+    """
+    if substituir:
+        db.session.execute(delete(Treino).where(Treino.user_id == user_id))
+    elif remover:
+        db.session.execute(delete(Treino).where(Treino.id.in_(remover)))
+    if atualizar:
+        db.session.execute(update(Treino), atualizar)
+    if inserir:
+        db.session.execute(insert(Treino), inserir)
+    mudou = substituir or inserir or atualizar or remover
+    if mudou:
+        db.session.execute(update(User).where(User.id == user_id).values(plano_versao=User.plano_versao + 1))
+    db.session.commit()
+    return {"inseridas": len(inserir), "atualizadas": len(atualizar), "removidas": len(remover)}
+
+
+def _desfazer_gravacao():
+    db.session.rollback()
+    # ids criados nesta transação não existem mais
+    estado = _estado()
+    with estado.exercicio_ids_lock:
+        estado.exercicio_ids.clear()
+
+
+def salvar_plano(user_id, plan, modo="substituir"):
+    """
+    Grava o plano do usuário numa única transação, sem criar um objeto Treino por linha.
+    - "substituir": apaga os treinos do usuário e insere tudo num único executemany
+    - "diff": casa as linhas por (dia, exercício); atualiza só séries/reps que mudaram,
+      insere as novas e apaga as que sumiram. Linhas idênticas não são tocadas.
+    Se algo mudou, incrementa User.plano_versao na mesma transação.
+    Retorna um dict com a contagem de linhas inseridas, atualizadas e removidas.
+    """
+    try:
+        linhas = _linhas_treino(user_id, plan)
+        if modo != "diff":
+            return _gravar_alteracoes(user_id, inserir=linhas, substituir=True)
+        existentes = {}
+        rows = db.session.execute(
+            select(Treino.id, Treino.dias_semana_id, Treino.exercicio_id, Treino.series, Treino.repeticoes)
+            .where(Treino.user_id == user_id)
+            .order_by(Treino.id)
+        )
+        for row in rows:
+            existentes.setdefault((row.dias_semana_id, row.exercicio_id), []).append(row)
+        inserir, atualizar = [], []
+        for linha in linhas:
+            candidatos = existentes.get((linha["dias_semana_id"], linha["exercicio_id"]))
+            if not candidatos:
+                inserir.append(linha)
                 continue
+            row = candidatos.pop(0)
+            if (row.series, row.repeticoes) != (linha["series"], linha["repeticoes"]):
+                atualizar.append({"id": row.id, "series": linha["series"], "repeticoes": linha["repeticoes"]})
+        remover = [row.id for sobra in existentes.values() for row in sobra]
+        return _gravar_alteracoes(user_id, inserir, atualizar, remover)
+    except Exception:
+        _desfazer_gravacao()
+        raise
 
-            # ordenar por tipo: compostos primeiro
-            ex_list = sorted(ex_list, key=lambda x: 0 if x.get("tipo") == "composto" else 1)
-            for ex in ex_list:
-                # evitar repetir o mesmo exercício na mesma semana
-                if ex["nome"] in used:
-                    continue
-                used.add(ex["nome"])
-                tipo = ex.get("tipo", "isolamento")
-                series = ex.get("series", 1)
-                repeticoes = reps_for(tipo)
-
-                # criar sugestão de progressão
-                if objetivo == "forca":
-                    progressao = f"Foco força: {series}x{repeticoes}. Aumentar carga gradualmente mantendo rep range."
-                elif objetivo == "emagrecimento":
-                    progressao = f"Foco condicionamento: {series}x{repeticoes}. Descansos curtos (~30-60s)."
-                else:
-                    upper = min(reps_compound[1], 15) if tipo == "composto" else min(reps_iso[1], 20)
-                    progressao = f"Hipertrofia: {series}x{repeticoes}. Aumente 1 rep/semana até {upper}, depois aumente carga."
-
-                plan.append({
-                    "dia": dias_lista[dia_idx],  # STRING: "Seg", "Ter", ...
-                    "grupo": g,
-                    "exercicio": ex["nome"],
-                    "series": int(series),
-                    "repeticoes": int(repeticoes),
-                    "tipo": tipo,
-                    "progressao": progressao
-                })
-
-    # ordenar por dia (usando a ordem em dias_lista) e priorizar compostos
-    def day_sort_key(x):
+
+# -------------------------
+# Edições pontuais do plano salvo
+# -------------------------
+def _treinos_salvos(user_id):
+    """Linhas do plano salvo com nome/grupo e o ExercicioDef do catálogo (None se não estiver nele)."""
+    rows = db.session.execute(
+        select(Treino.id, Treino.dias_semana_id, Treino.series, Treino.repeticoes,
+               Exercicio.nome, Exercicio.grupo_muscular)
+        .join(Exercicio, Treino.exercicio_id == Exercicio.id)
+        .where(Treino.user_id == user_id)
+        .order_by(Treino.dias_semana_id, Treino.id)
+    ).all()
+    defs = []
+    for row in rows:
+        e = CATALOGO.por_nome.get(row.nome)
+        defs.append(e if e is not None and e.grupo == row.grupo_muscular else None)
+    return rows, defs
+
+
+def regenerar_trecho(user_id, perfil, dia=None, grupo=None, rng=None):
+    """
+    Regenera só os itens salvos do `dia` (índice 0..6) e/ou do `grupo`, sem reescrever a semana.
+    O volume de séries de cada (dia, grupo) é mantido; o resto do plano entra como `usados` e os
+    exercícios atuais só voltam se o grupo não tiver outra opção. Pernas, nas divisões com Perna
+    A/B, sai de escolher_perna com o bloco do dia, como no build_plan. As linhas afetadas são
+    reaproveitadas (UPDATE por id); só as que sobram ou faltam são apagadas/inseridas.
+    Retorna as contagens da gravação, ou None se nenhum item salvo casar com o filtro.
+    """
+    rng = rng or random
+    nivel, objetivo, divisao, _, peso, altura, idade = perfil
+    chave_objetivo, params, mult, iniciante = _parametros_perfil(nivel, objetivo, peso, altura, idade)
+    reps_compound, reps_iso, sets_compound, sets_iso = params
+
+    rows, defs = _treinos_salvos(user_id)
+    # exercícios fora do catálogo (planos antigos/personalizados) não são regenerados
+    afetadas = [(row, e) for row, e in zip(rows, defs)
+                if e is not None and (dia is None or row.dias_semana_id == dia)
+                and (grupo is None or e.grupo == grupo)]
+    if not afetadas:
+        return None
+    ids_afetados = [row.id for row, _ in afetadas]
+    fora = set(ids_afetados)
+    usados = _mascara(e for row, e in zip(rows, defs) if row.id not in fora)
+    atuais = _mascara(e for _, e in afetadas)
+
+    celulas = {}
+    for row, e in afetadas:
+        celulas[(row.dias_semana_id, e.grupo)] = celulas.get((row.dias_semana_id, e.grupo), 0) + row.series
+    # o build_plan alterna Perna A/B pelos dias de perna da semana, em ordem: o 1º é A, o 2º B...
+    alterna_perna = divisao in DIVISOES_PERNA_AB
+    dias_perna = sorted({row.dias_semana_id for row in rows if row.grupo_muscular == "Pernas"})
+
+    novos = []
+    for (d, g), series_necessarias in celulas.items():
+        escolhas = []
+        if g == "Pernas" and alterna_perna:
+            # mesmo bloco do dia, com o teto de séries dos compostos e o mínimo de MIN_EXS_PER_PERNA
+            for e, series in escolher_perna(rng, series_necessarias, dias_perna.index(d) % 2 == 0, usados,
+                                            sets_compound, sets_iso, mult):
+                if not usados >> e.id & 1:
+                    usados |= 1 << e.id
+                    escolhas.append((e, series))
+        else:
+            feitas = 0
+            for evitar in (atuais, 0):
+                if feitas >= series_necessarias:
+                    break
+                bloqueados = usados | evitar
+                for e, series in escolher_exercicios_grupo(rng, g, series_necessarias - feitas, bloqueados,
+                                                           sets_compound, sets_iso, mult):
+                    if bloqueados >> e.id & 1:
+                        continue
+                    bloqueados |= 1 << e.id
+                    usados |= 1 << e.id
+                    feitas += series
+                    escolhas.append((e, series))
+        compostos, isolamentos = [], []
+        for e, series in escolhas:
+            repeticoes = _reps(rng, e.tipo, reps_compound, reps_iso, iniciante)
+            destino = compostos if e.tipo == "composto" else isolamentos
+            destino.append(PlanItem(d, e.id, int(series), int(repeticoes), chave_objetivo))
+        novos += compostos + isolamentos
+
+    try:
+        linhas = _linhas_treino(user_id, novos)
+        atualizar = [dict(linha, id=treino_id) for treino_id, linha in zip(ids_afetados, linhas)]
+        for linha in atualizar:
+            del linha["user_id"]
+        return _gravar_alteracoes(user_id, inserir=linhas[len(ids_afetados):], atualizar=atualizar,
+                                  remover=ids_afetados[len(linhas):])
+    except Exception:
+        _desfazer_gravacao()
+        raise
+
+
+def trocar_exercicio(user_id, treino_id, rng=None):
+    """
+    Troca o exercício de uma linha do plano por outro do mesmo grupo (mesmo tipo, se houver)
+    que ainda não esteja na semana; séries e reps continuam. Se o grupo inteiro já estiver no
+    plano, permuta com o exercício do mesmo grupo de outro dia. Só as linhas trocadas são alteradas.
+    Retorna o ExercicioDef escolhido, ou None se a linha não existir ou não houver alternativa.
+    """
+    rng = rng or random
+    rows, defs = _treinos_salvos(user_id)
+    for row, atual in zip(rows, defs):
+        if row.id == treino_id:
+            break
+    else:
+        return None
+    grupo = atual.grupo if atual is not None else row.grupo_muscular
+    usados = _mascara(defs)
+    livres = [e for e in CATALOGO.por_grupo.get(grupo, ()) if not usados >> e.id & 1]
+    permutas = []
+    if not livres and atual is not None:
+        permutas = [(r, e) for r, e in zip(rows, defs)
+                    if e is not None and e.grupo == grupo and r.dias_semana_id != row.dias_semana_id]
+        livres = [e for _, e in permutas]
+    if not livres:
+        return None
+    mesmo_tipo = [e for e in livres if atual is not None and e.tipo == atual.tipo]
+    novo = rng.choice(mesmo_tipo or livres)
+    try:
+        ids = exercicio_ids({(novo.nome, novo.grupo)} | ({(atual.nome, atual.grupo)} if permutas else set()))
+        atualizar = [{"id": row.id, "exercicio_id": ids[(novo.nome, novo.grupo)]}]
+        for r, e in permutas:
+            if e is novo:
+                atualizar.append({"id": r.id, "exercicio_id": ids[(atual.nome, atual.grupo)]})
+        _gravar_alteracoes(user_id, atualizar=atualizar)
+    except Exception:
+        _desfazer_gravacao()
+        raise
+    return novo
+
+
+# -------------------------
+# Estatísticas de treino
+# -------------------------
+STATS_AGRUPAMENTOS = ("dia", "grupo")
+
+stats_cache = cache_do_app("stats")
+
+
+def _agregar_treinos(user_id, por):
+    contagem = func.count(Treino.id)
+    series = func.coalesce(func.sum(Treino.series), 0)
+    volume = func.coalesce(func.sum(Treino.series * Treino.repeticoes), 0)
+    if por == "grupo":
+        rows = ler(
+            select(Exercicio.grupo_muscular, contagem, series, volume)
+            .join(Treino.exercicio_ref)
+            .where(Treino.user_id == user_id)
+            .group_by(Exercicio.grupo_muscular)
+        )
+        # grupos do catálogo na ordem de sempre, desconhecidos no fim
+        ordem = {g: i for i, g in enumerate(GRUPOS_LIVRE)}
+        rows.sort(key=lambda r: (ordem.get(r[0], len(ordem)), r[0]))
+        labels = [r[0] for r in rows]
+        return {"labels": labels, "data": [r[1] for r in rows], "series": [int(r[2]) for r in rows],
+                "volume": [int(r[3]) for r in rows], "total": sum(r[1] for r in rows)}
+
+    counts, series_dia, volume_dia = [0] * 7, [0] * 7, [0] * 7
+    rows = ler(
+        select(Treino.dias_semana_id, contagem, series, volume)
+        .where(Treino.user_id == user_id, Treino.dias_semana_id.is_not(None))
+        .group_by(Treino.dias_semana_id)
+    )
+    for dia, n, s, v in rows:
+        idx = int(dia) % 7
+        counts[idx] += n
+        series_dia[idx] += int(s)
+        volume_dia[idx] += int(v)
+    return {"labels": list(DIAS_LISTA), "data": counts, "series": series_dia, "volume": volume_dia,
+            "total": sum(counts)}
+
+
+def plano_versao_atual(user_id):
+    """
+    User.plano_versao lido agora do banco (engine de leitura). Entra na chave dos caches derivados
+    dos treinos: uma gravação em qualquer worker muda a versão, então nenhum processo precisa ser
+    avisado para descartar o que cacheou (com o backend "memory" cada worker tem o seu cache).
+    """
+    rows = ler(select(User.plano_versao).where(User.id == user_id))
+    return rows[0][0] if rows else 0
+
+
+def treino_stats(user_id, por="dia"):
+    """
+    Agrega os treinos do usuário por dia ou grupo muscular com GROUP BY no banco
+    (contagem, séries totais e volume = séries x reps), sem carregar objetos Treino.
+    Cacheado por usuário e versão do plano quando STATS_CACHE_TTL > 0.
+    """
+    if current_app.config['STATS_CACHE_TTL'] <= 0:
+        return _agregar_treinos(user_id, por)
+    chave = ("stats", user_id, plano_versao_atual(user_id), por)
+    stats = stats_cache.get(chave)
+    if stats is None:
+        stats = _agregar_treinos(user_id, por)
+        stats_cache.set(chave, stats)
+    return stats
+
+
+def _calcular_resumo(user_id):
+    # uma única consulta; o resto é agregado aqui (um plano tem dezenas de linhas, não milhares)
+    rows = ler(
+        select(Treino.dias_semana_id, Exercicio.nome, Exercicio.grupo_muscular, Treino.series, Treino.repeticoes)
+        .outerjoin(Treino.exercicio_ref)
+        .where(Treino.user_id == user_id)
+        .order_by(Treino.dias_semana_id, Treino.id)
+    )
+
+    por_dia = {"labels": list(DIAS_LISTA), "data": [0] * 7, "series": [0] * 7, "volume": [0] * 7}
+    grupos = {}
+    for dia, _nome, grupo, series, reps in rows:
+        series, volume = series or 0, (series or 0) * (reps or 0)
+        if dia is not None:
+            idx = int(dia) % 7
+            por_dia["data"][idx] += 1
+            por_dia["series"][idx] += series
+            por_dia["volume"][idx] += volume
+        if grupo is not None:
+            g = grupos.setdefault(grupo, [0, 0, 0])
+            g[0] += 1
+            g[1] += series
+            g[2] += volume
+    por_dia["total"] = sum(por_dia["data"])
+
+    ordem = {g: i for i, g in enumerate(GRUPOS_LIVRE)}
+    labels = sorted(grupos, key=lambda g: (ordem.get(g, len(ordem)), g))
+    por_grupo = {"labels": labels, "data": [grupos[g][0] for g in labels], "series": [grupos[g][1] for g in labels],
+                 "volume": [grupos[g][2] for g in labels], "total": sum(grupos[g][0] for g in labels)}
+
+    recentes = [{"dias_semana_id": dia, "exercicio": nome, "grupo_muscular": grupo, "series": series, "repeticoes": reps}
+                for dia, nome, grupo, series, reps in rows[:6]]
+    return {"total": len(rows), "recentes": recentes, "por_dia": por_dia, "por_grupo": por_grupo}
+
+
+def resumo_dashboard(user_id):
+    """
+    Resumo do dashboard (total, 6 primeiros treinos, contagens por dia e volume por grupo)
+    calculado com uma consulta e cacheado por versão do plano. Também alimenta o cache de
+    treino_stats, já que as agregações são as mesmas.
+    """
+    versao = plano_versao_atual(user_id)
+    chave = ("resumo", user_id, versao)
+    resumo = stats_cache.get(chave)
+    if resumo is None:
+        resumo = _calcular_resumo(user_id)
+        if current_app.config['STATS_CACHE_TTL'] > 0:
+            stats_cache.set(chave, resumo)
+            stats_cache.set(("stats", user_id, versao, "dia"), resumo["por_dia"])
+            stats_cache.set(("stats", user_id, versao, "grupo"), resumo["por_grupo"])
+    return resumo
+
+
+# -------------------------
+# Consulta paginada de treinos (/api/treinos)
+# -------------------------
+TREINO_CAMPOS = MappingProxyType({
+    "id": Treino.id,
+    "dia": Treino.dias_semana_id,
+    "grupo": Exercicio.grupo_muscular,
+    "exercicio": Exercicio.nome,
+    "series": Treino.series,
+    "repeticoes": Treino.repeticoes,
+})
+TREINOS_LIMITE_MAX = 500
+
+
+def _cursor_treinos(dia, treino_id):
+    return base64.urlsafe_b64encode(f"{dia}:{treino_id}".encode()).decode().rstrip("=")
+
+
+def _ler_cursor_treinos(cursor):
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        dia, treino_id = bruto.split(":")
+        return int(dia), int(treino_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("cursor inválido")
+
+
+def _consulta_treinos(user_id, args):
+    """
+    Monta o select só com as colunas pedidas (sem hidratar Treino) a partir dos args da request.
+    Levanta ValueError para parâmetros inválidos.
+    """
+    campos = [c.strip() for c in args.get("fields", "").split(",") if c.strip()] or list(TREINO_CAMPOS)
+    desconhecidos = [c for c in campos if c not in TREINO_CAMPOS]
+    if desconhecidos:
+        raise ValueError(f"campos desconhecidos: {', '.join(desconhecidos)}")
+
+    limite = args.get("limit")
+    if limite is not None:
         try:
-            return (dias_lista.index(x["dia"]), 0 if x.get("tipo") == "composto" else 1)
-        except:
-            return (0, 1)
+            limite = int(limite)
+        except ValueError:
+            raise ValueError("limit deve ser um número")
+        if not 1 <= limite <= TREINOS_LIMITE_MAX:
+            raise ValueError(f"limit deve estar entre 1 e {TREINOS_LIMITE_MAX}")
+
+    # NULL ordena como -1, para o cursor ter sempre um valor comparável
+    dia_ordem = func.coalesce(Treino.dias_semana_id, -1).label("dia_ordem")
+    stmt = select(Treino.id, dia_ordem, *(TREINO_CAMPOS[c].label(c) for c in campos if c != "id"))
+    grupo = args.get("grupo")
+    if grupo or "grupo" in campos or "exercicio" in campos:
+        stmt = stmt.outerjoin(Treino.exercicio_ref)
+    stmt = stmt.where(Treino.user_id == user_id)
+
+    dia = args.get("dia")
+    if dia is not None:
+        if dia not in DIA_INDEX and not (dia.isdigit() and int(dia) < 7):
+            raise ValueError("dia deve ser Seg..Dom ou 0..6")
+        stmt = stmt.where(Treino.dias_semana_id == _dia_para_indice(dia))
+    if grupo:
+        stmt = stmt.where(Exercicio.grupo_muscular == grupo)
+
+    cursor = args.get("cursor")
+    if cursor:
+        c_dia, c_id = _ler_cursor_treinos(cursor)
+        stmt = stmt.where(or_(dia_ordem > c_dia, and_(dia_ordem == c_dia, Treino.id > c_id)))
+
+    stmt = stmt.order_by(dia_ordem, Treino.id)
+    if limite is not None:
+        stmt = stmt.limit(limite + 1)
+    return {"select": stmt, "campos": campos, "limite": limite}
 
-    plan = sorted(plan, key=day_sort_key)
 
-    return plan
+# -------------------------
+# Migração do banco
+# -------------------------
+SCHEMA_VERSION = 2
+
+
+def _colunas(conn, tabela):
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({tabela})")}
+
+
+def migrar_db():
+    """
+    Cria as tabelas que faltam e atualiza bancos antigos (PRAGMA user_version).
+    v1: Treino passa a referenciar a tabela exercicio (nome/grupo deixam de se repetir
+        em cada linha) e ganha o índice (user_id, dias_semana_id).
+    v2: User.plano_versao.
+    """
+    db.create_all()
+    with db.engine.begin() as conn:
+        versao = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        if versao < 1:
+            if "exercicio" in _colunas(conn, "treino"):
+                # SQLite não altera colunas: renomeia, recria no formato novo e copia
+                conn.exec_driver_sql("ALTER TABLE treino RENAME TO treino_legado")
+                conn.exec_driver_sql("DROP INDEX IF EXISTS ix_treino_user_dia")
+                Treino.__table__.create(conn)
+                conn.exec_driver_sql(
+                    "INSERT OR IGNORE INTO exercicio (nome, grupo_muscular) "
+                    "SELECT DISTINCT exercicio, COALESCE(grupo_muscular, '') FROM treino_legado "
+                    "WHERE exercicio IS NOT NULL"
+                )
+                conn.exec_driver_sql(
+                    "INSERT INTO treino (id, user_id, dias_semana_id, exercicio_id, series, repeticoes) "
+                    "SELECT t.id, t.user_id, t.dias_semana_id, e.id, t.series, t.repeticoes "
+                    "FROM treino_legado t LEFT JOIN exercicio e "
+                    "ON e.nome = t.exercicio AND e.grupo_muscular = COALESCE(t.grupo_muscular, '')"
+                )
+                conn.exec_driver_sql("DROP TABLE treino_legado")
+            conn.execute(
+                sqlite_insert(Exercicio).on_conflict_do_nothing(),
+                [{"nome": e.nome, "grupo_muscular": e.grupo} for e in CATALOGO.exercicios],
+            )
+        if versao < 2:
+            if "plano_versao" not in _colunas(conn, "user"):
+                conn.exec_driver_sql("ALTER TABLE user ADD COLUMN plano_versao INTEGER NOT NULL DEFAULT 0")
+        if versao < SCHEMA_VERSION:
+            conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+@bp.cli.command("migrar-db")
+def migrar_db_command():
+    """Cria/atualiza o schema do banco."""
+    migrar_db()
+    print(f"Banco na versão {SCHEMA_VERSION}.")
+
+
+# -------------------------
+# Assets estáticos (bundle + hash no nome + pré-compressão)
+# -------------------------
+# `flask --app app build-assets` junta o CSS (resolvendo os @import), minifica CSS/JS, grava em
+# static/dist/ com o hash do conteúdo no nome (+ .gz e, com o pacote brotli, .br) e escreve o
+# manifest.json. Os templates usam asset_url(); sem manifest (dev) cai no arquivo original.
+DIST_FOLDER = os.path.join(BASE_DIR, 'static', 'dist')
+ASSETS = ("css/style.css", "js/theme.js")
+_IMPORT_CSS = re.compile(r'@import\s+(?:url\()?\s*["\']?([^"\')]+)["\']?\s*\)?\s*;')
+
+
+def _css_bundle(caminho, vistos=None):
+    """Conteúdo do CSS com os @import locais substituídos pelo arquivo importado (recursivo)."""
+    vistos = set() if vistos is None else vistos
+    vistos.add(os.path.abspath(caminho))
+    with open(caminho, encoding="utf-8") as f:
+        css = f.read()
+
+    def incluir(m):
+        alvo = os.path.join(os.path.dirname(caminho), m.group(1))
+        if "//" in m.group(1) or not os.path.isfile(alvo) or os.path.abspath(alvo) in vistos:
+            return m.group(0)
+        return _css_bundle(alvo, vistos)
+
+    return _IMPORT_CSS.sub(incluir, css)
+
+
+def minificar_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    # espaço antes de ":" pode ser combinador (".a :hover"); só o de depois sai
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+def minificar_js(js):
+    # conservador: só comentários de bloco, comentários de linha inteira e indentação
+    js = re.sub(r"/\*.*?\*/", "", js, flags=re.S)
+    linhas = (linha.strip() for linha in js.splitlines())
+    return "\n".join(linha for linha in linhas if linha and not linha.startswith("//"))
+
+
+def build_assets(destino=DIST_FOLDER):
+    """Gera os bundles em `destino` e devolve o manifest {original: dist/nome.hash.ext}."""
+    os.makedirs(destino, exist_ok=True)
+    manifest = {}
+    for nome in ASSETS:
+        origem = os.path.join(BASE_DIR, 'static', nome)
+        base, ext = os.path.splitext(os.path.basename(nome))
+        if ext == ".css":
+            conteudo = minificar_css(_css_bundle(origem))
+        else:
+            with open(origem, encoding="utf-8") as f:
+                conteudo = minificar_js(f.read())
+        dados = conteudo.encode("utf-8")
+        arquivo = f"{base}.{hashlib.sha256(dados).hexdigest()[:12]}{ext}"
+        with open(os.path.join(destino, arquivo), "wb") as f:
+            f.write(dados)
+        with open(os.path.join(destino, arquivo + ".gz"), "wb") as f:
+            f.write(gzip.compress(dados, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(os.path.join(destino, arquivo + ".br"), "wb") as f:
+                f.write(brotli.compress(dados))
+        manifest[nome] = f"dist/{arquivo}"
+    with open(os.path.join(destino, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def carregar_manifest():
+    try:
+        with open(os.path.join(DIST_FOLDER, "manifest.json"), encoding="utf-8") as f:
+            return MappingProxyType(json.load(f))
+    except (OSError, ValueError):
+        return MappingProxyType({})
+
+
+_asset_manifest = None
+
+
+def asset_manifest():
+    """Manifest do static/dist, lido na primeira vez que é pedido (ou em preparar_pre_fork)."""
+    global _asset_manifest
+    if _asset_manifest is None:
+        _asset_manifest = carregar_manifest()
+    return _asset_manifest
+
+
+@bp.app_template_global()
+def asset_url(filename, **valores):
+    """Igual a url_for('static', filename=...), mas aponta para o bundle versionado se existir."""
+    return url_for('static', filename=asset_manifest().get(filename, filename), **valores)
+
+
+@bp.cli.command("build-assets")
+def build_assets_command():
+    """Gera os bundles de CSS/JS em static/dist."""
+    for original, gerado in build_assets().items():
+        print(f"{original} -> {gerado}")
+    if brotli is None:
+        print("pacote brotli não instalado: só .gz gerado")
 
 
 # -------------------------
 # Routes
 # -------------------------
-@app.route("/")
+@bp.route("/")
 def index():
     get_flashed_messages()
     return render_template("index.html")
 
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
         nome = request.form.get("nome", "").strip()
@@ -513,44 +2346,60 @@ def register():
 
         if not nome or not email or not senha:
             flash("Preencha todos os campos.", "error")
-            return redirect(url_for("register"))
+            return redirect(url_for("main.register"))
 
         if User.query.filter_by(email=email).first():
             flash("Este email já está cadastrado!", "error")
-            return redirect(url_for("register"))
+            return redirect(url_for("main.register"))
 
-        novo = User(nome=nome, email=email, senha=generate_password_hash(senha))
+        try:
+            novo = User(nome=nome, email=email, senha=gerar_hash_senha(senha))
+        except HashOcupado:
+            flash("Servidor ocupado, tente de novo em alguns segundos.", "error")
+            return _hash_ocupado("register.html")
         db.session.add(novo)
         db.session.commit()
         flash("Conta criada com sucesso! Faça login.", "success")
-        return redirect(url_for("login"))
+        return redirect(url_for("main.login"))
 
     return render_template("register.html")
 
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         email = request.form.get("email", "").strip().lower()
         senha = request.form.get("senha", "")
         user = User.query.filter_by(email=email).first()
-        if user and check_password_hash(user.senha, senha):
+        try:
+            valida = bool(user) and verificar_senha(user.senha, senha)
+        except HashOcupado:
+            flash("Servidor ocupado, tente de novo em alguns segundos.", "error")
+            return _hash_ocupado("login.html")
+        if valida:
+            # hash antigo (método/iterações de antes): refaz com a senha que acabou de conferir
+            if precisa_rehash(user.senha):
+                try:
+                    user.senha = gerar_hash_senha(senha)
+                    db.session.commit()
+                except HashOcupado:
+                    pass  # fica para o próximo login
             login_user(user, remember=True)
             flash("Login realizado com sucesso!", "success")
-            return redirect(url_for("dashboard"))
+            return redirect(url_for("main.dashboard"))
         flash("Email ou senha incorretos!", "error")
     return render_template("login.html")
 
 
-@app.route("/logout")
+@bp.route("/logout")
 @login_required
 def logout():
     logout_user()
     flash("Você saiu da conta.", "info")
-    return redirect(url_for("index"))
+    return redirect(url_for("main.index"))
 
 
-@app.route('/perfil', methods=['GET', 'POST'])
+@bp.route('/perfil', methods=['GET', 'POST'])
 @login_required
 def perfil():
     if request.method == "POST":
@@ -563,165 +2412,368 @@ def perfil():
             other = User.query.filter(User.email == email, User.id != current_user.id).first()
             if other:
                 flash("Email já está em uso por outra conta.", "error")
-                return redirect(url_for('perfil'))
+                return redirect(url_for('main.perfil'))
             current_user.email = email
         if senha and senha.strip() != "":
-            current_user.senha = generate_password_hash(senha)
+            try:
+                current_user.senha = gerar_hash_senha(senha)
+            except HashOcupado:
+                db.session.rollback()
+                flash("Servidor ocupado, tente de novo em alguns segundos.", "error")
+                return redirect(url_for('main.perfil'))
         if 'foto' in request.files:
             foto = request.files['foto']
             if foto and foto.filename != '' and allowed_file(foto.filename):
-                filename = secure_filename(f"{current_user.id}_{random.randint(1000,9999)}_{foto.filename}")
-                filepath = os.path.join(UPLOAD_FOLDER, filename)
-                foto.save(filepath)
-                current_user.foto = filename
+                try:
+                    current_user.foto = guardar_upload(foto)
+                except ValueError as e:
+                    db.session.rollback()
+                    flash(str(e), "error")
+                    return redirect(url_for('main.perfil'))
         db.session.commit()
+        invalidar_cache_user(current_user.id)
         flash("Perfil atualizado com sucesso!", "success")
-        return redirect(url_for('perfil'))
+        return redirect(url_for('main.perfil'))
     return render_template("perfil.html")
 
 
-@app.route('/uploads/<filename>')
+@bp.route('/static/dist/<path:filename>')
+def asset_dist(filename):
+    # nome já tem o hash do conteúdo: pode ficar em cache para sempre; serve .br/.gz pré-comprimidos
+    mimetype = mimetypes.guess_type(filename)[0]
+    resp = None
+    for codificacao, ext in (("br", ".br"), ("gzip", ".gz")):
+        if codificacao in request.accept_encodings and os.path.isfile(os.path.join(DIST_FOLDER, filename + ext)):
+            resp = send_from_directory(DIST_FOLDER, filename + ext, mimetype=mimetype)
+            resp.headers["Content-Encoding"] = codificacao
+            break
+    if resp is None:
+        resp = send_from_directory(DIST_FOLDER, filename, mimetype=mimetype)
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+
+@bp.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
-
-
-@app.route("/configuracoes")
+    # ?tam=96|256 entrega a miniatura WebP (se já gerada e o navegador aceitar WebP); o nome é o
+    # hash do conteúdo, então a resposta nunca muda: cache longo + ETag/Last-Modified do send_file
+    tam = request.args.get('tam', type=int)
+    servir, definitivo = filename, tam is None
+    if tam in MINIATURAS and request.accept_mimetypes["image/webp"]:
+        miniatura = _nome_miniatura(filename, tam)
+        if os.path.isfile(os.path.join(UPLOAD_FOLDER, miniatura)):
+            servir, definitivo = miniatura, True
+        elif Image is not None and (origem := safe_join(UPLOAD_FOLDER, filename)) and os.path.isfile(origem):
+            # miniatura ainda não existe (upload recente ou foto antiga): gera e, por ora, manda o original
+            _pool_imagens.submit(gerar_miniaturas, filename, current_app.logger)
+    resp = send_from_directory(UPLOAD_FOLDER, servir, max_age=31536000)
+    # enquanto a miniatura não existe o original não pode ficar em cache nessa URL
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable" if definitivo else "no-cache"
+    resp.vary.add("Accept")
+    return resp
+
+
+@bp.app_errorhandler(413)
+def upload_grande_demais(erro):
+    if request.endpoint != 'main.perfil':
+        return erro
+    flash(f"A foto deve ter no máximo {current_app.config['UPLOAD_MAX_BYTES'] // (1024 * 1024)} MB.", "error")
+    return redirect(url_for('main.perfil'))
+
+
+@bp.route("/configuracoes")
 @login_required
 def configuracoes():
     return render_template("config.html")
 
 
-@app.route("/dashboard")
+@bp.route("/dashboard")
 @login_required
 def dashboard():
-    # dados para cards resumidos
-    total = Treino.query.filter_by(user_id=current_user.id).count()
-    stats = Treino.query.filter_by(user_id=current_user.id).order_by(Treino.dias_semana_id).limit(6).all()
-    return render_template("dashboard.html", total=total, treinos=stats)
+    # dados para cards resumidos + gráfico, tudo do mesmo resumo (o gráfico não precisa de outro fetch)
+    resumo = resumo_dashboard(current_user.id)
+    return render_template("dashboard.html", total=resumo["total"], treinos=resumo["recentes"], resumo=resumo)
 
 
-@app.route("/gerador")
+@bp.route("/gerador")
 @login_required
 def gerador():
     # página exclusivamente do gerador (AJAX preview + salvar)
     return render_template("gerador.html")
 
 
-@app.route("/gerar_plano", methods=["POST"])
+@bp.route("/gerar_plano", methods=["POST"])
 @login_required
 def gerar_plano():
     # os dados podem vir via form normal (submit) ou fetch (AJAX)
-    nivel = request.form.get("nivel", "iniciante")
-    objetivo = request.form.get("objetivo", "hipertrofia")
-    divisao = request.form.get("divisao", "livre")
-    dias = request.form.getlist("dias")
-    try:
-        peso = float(request.form.get("peso") or 0)
-    except:
-        peso = 0.0
-    try:
-        altura = float(request.form.get("altura") or 0)
-    except:
-        altura = 0.0
-    try:
-        idade = int(request.form.get("idade") or 0)
-    except:
-        idade = 0
+    perfil = _perfil_do_form(request.form)
 
-    # gera plano (lista de dicts)
-    plan = build_plan(nivel, objetivo, divisao, dias, peso, altura, idade)
+    # gera plano (lista de dicts) — previews repetidos saem do cache;
+    # modo=otimizar escolhe o melhor entre vários candidatos (pool de processos)
+    if request.values.get('modo') == 'otimizar':
+        plan = otimizar_plano(perfil)
+    else:
+        plan = plano_cacheado(perfil)
 
-    # se for preview (AJAX), retorna JSON sem salvar
+    # se for preview (AJAX), retorna JSON sem salvar, com o token para confirmar este plano
     if request.args.get('preview') == '1' or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return jsonify({"status":"ok", "plan": plan})
+        # ?progressao=1 inclui o texto de progressão de cada item
+        return jsonify({"status":"ok", "plan": plano_json(plan, request.args.get('progressao') == '1'),
+                        "token": guardar_preview(current_user.id, plan)})
 
     # caso contrário, salva no DB substituindo treinos antigos
+    return _salvar_e_redirecionar(plan)
+
+
+@bp.route("/gerar_plano/confirmar", methods=["POST"])
+@login_required
+def confirmar_plano():
+    # salva exatamente o plano da pré-visualização (sem gerar de novo)
+    plan = retirar_preview(current_user.id, request.form.get("token", ""))
+    if plan is None:
+        flash("A pré-visualização expirou. Gere o plano novamente.", "error")
+        return redirect(url_for("main.gerador"))
+    return _salvar_e_redirecionar(plan)
+
+
+def _salvar_e_redirecionar(plan):
     try:
-        Treino.query.filter_by(user_id=current_user.id).delete()
-        # mapeador de dias (string -> índice)
-        dias_lista = ["Seg","Ter","Qua","Qui","Sex","Sáb","Dom"]
-        for item in plan:
-            dia_val = item.get('dia')
-            # converte dia string ("Seg") para índice integer (0..6)
-            dia_idx = None
-            if isinstance(dia_val, str):
-                try:
-                    dia_idx = dias_lista.index(dia_val)
-                except ValueError:
-                    # tenta extrair número se for "0", "1", etc.
-                    try:
-                        dia_idx = int(dia_val) % 7
-                    except:
-                        dia_idx = 0
-            else:
-                try:
-                    dia_idx = int(dia_val) % 7
-                except:
-                    dia_idx = 0
-
-            novo = Treino(
-                user_id=current_user.id,
-                dias_semana_id=int(dia_idx),
-                grupo_muscular=item.get('grupo'),
-                exercicio=item.get('exercicio'),
-                series=int(item.get('series', 0)),
-                repeticoes=int(item.get('repeticoes', 0))
-            )
-            db.session.add(novo)
-        db.session.commit()
+        salvar_plano(current_user.id, plan, modo=current_app.config['MODO_SALVAR_PLANO'])
         flash(f"Plano gerado com sucesso! {len(plan)} exercícios adicionados.", "success")
     except Exception as e:
         db.session.rollback()
         flash("Erro ao salvar plano.", "error")
-    return redirect(url_for("dashboard"))
+    return redirect(url_for("main.dashboard"))
 
 
-@app.route("/trocar_tema", methods=["POST"])
+@bp.route("/trocar_tema", methods=["POST"])
 @login_required
 def trocar_tema():
     user = current_user
     novo = "light" if user.theme == "dark" else "dark"
     user.theme = novo
     db.session.commit()
+    invalidar_cache_user(user.id)
     return {"status": "ok", "theme": novo}
 
 
+# Edições pontuais do plano salvo (JSON). Regenerar usa os campos de perfil do gerador
+# (nivel, objetivo, peso, altura, idade) para séries/reps e a divisão para os blocos de perna;
+# os dias e os grupos de cada dia vêm do plano salvo.
+@bp.route("/plano/dia/<dia>/regenerar", methods=["POST"])
+@login_required
+def regenerar_dia(dia):
+    if dia not in DIA_INDEX:
+        return jsonify({"status": "erro", "mensagem": f"dia deve ser um de: {', '.join(DIAS_LISTA)}"}), 400
+    return _regenerar(dia=DIA_INDEX[dia])
+
+
+@bp.route("/plano/grupo/<grupo>/regenerar", methods=["POST"])
+@login_required
+def regenerar_grupo(grupo):
+    if grupo not in CATALOGO.por_grupo:
+        return jsonify({"status": "erro", "mensagem": f"grupo desconhecido: {grupo}"}), 400
+    return _regenerar(grupo=grupo)
+
+
+def _regenerar(dia=None, grupo=None):
+    # o plano salvo não guarda o perfil: sem nível/objetivo as séries e reps sairiam dos padrões
+    faltando = [c for c in ("nivel", "objetivo") if not request.form.get(c)]
+    if faltando:
+        return jsonify({"status": "erro", "mensagem": f"informe {' e '.join(faltando)} do perfil"}), 400
+    try:
+        perfil = normalizar_perfil(_perfil_do_form(request.form))
+    except ValueError as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 400
+    try:
+        contagens = regenerar_trecho(current_user.id, perfil, dia=dia, grupo=grupo)
+    except Exception:
+        return jsonify({"status": "erro", "mensagem": "Erro ao salvar plano."}), 500
+    if contagens is None:
+        return jsonify({"status": "erro", "mensagem": "Nenhum exercício do plano salvo nesse filtro."}), 404
+    return jsonify({"status": "ok", **contagens})
+
+
+@bp.route("/plano/treino/<int:treino_id>/trocar", methods=["POST"])
+@login_required
+def trocar_treino(treino_id):
+    try:
+        novo = trocar_exercicio(current_user.id, treino_id)
+    except Exception:
+        return jsonify({"status": "erro", "mensagem": "Erro ao salvar plano."}), 500
+    if novo is None:
+        return jsonify({"status": "erro", "mensagem": "Exercício não encontrado ou sem alternativa no grupo."}), 404
+    return jsonify({"status": "ok", "id": treino_id, "exercicio": novo.nome, "grupo": novo.grupo, "tipo": novo.tipo})
+
+
 # API endpoints
-@app.route("/api/treinos_stats")
+@bp.route("/api/treinos_stats")
 @login_required
 def api_treinos_stats():
-    counts = [0] * 7
-    treinos = Treino.query.filter_by(user_id=current_user.id).all()
-    for t in treinos:
-        try:
-            idx = int(t.dias_semana_id) % 7
-            counts[idx] += 1
-        except:
-            pass
-    labels = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
-    return jsonify({"labels": labels, "data": counts, "total": sum(counts)})
+    # ?por=dia (padrão, usado pelo gráfico do dashboard) ou ?por=grupo
+    por = request.args.get("por", "dia")
+    if por not in STATS_AGRUPAMENTOS:
+        return jsonify({"status": "erro", "mensagem": f"por deve ser um de: {', '.join(STATS_AGRUPAMENTOS)}"}), 400
+    return jsonify(treino_stats(current_user.id, por))
 
 
-@app.route("/api/treinos")
+@bp.route("/api/treinos")
 @login_required
 def api_treinos():
-    treinos = Treino.query.filter_by(user_id=current_user.id).order_by(Treino.dias_semana_id).all()
-    out = []
-    for t in treinos:
-        out.append({
-            "id": t.id,
-            "dia": t.dias_semana_id,
-            "grupo": t.grupo_muscular,
-            "exercicio": t.exercicio,
-            "series": t.series,
-            "repeticoes": t.repeticoes
-        })
-    return jsonify(out)
-
-
-# Init DB
-with app.app_context():
-    db.create_all()
+    """
+    Lista os treinos do usuário (ordem: dia, id). Parâmetros opcionais:
+    - limit / cursor: paginação por cursor; o próximo cursor vem no header X-Next-Cursor (e em Link)
+    - fields=id,dia,...: só esses campos em cada item
+    - dia=Seg|0..6 e grupo=Peito: filtros
+    Responde 304 quando o If-None-Match bate com a versão atual do plano.
+    """
+    # versão lida agora do banco: o user_cache é por processo e não vê gravações de outro worker
+    etag = f"treinos-{current_user.id}-{plano_versao_atual(current_user.id)}"
+    if request.if_none_match.contains_weak(etag):
+        resp = current_app.response_class(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    try:
+        consulta = _consulta_treinos(current_user.id, request.args)
+    except ValueError as e:
+        return jsonify({"status": "erro", "mensagem": str(e)}), 400
+    campos, limite = consulta["campos"], consulta["limite"]
+
+    rows = ler(consulta["select"])
+    proximo = None
+    if limite is not None and len(rows) > limite:
+        rows = rows[:limite]
+        ultimo = rows[-1]
+        proximo = _cursor_treinos(ultimo.dia_ordem, ultimo.id)
+
+    resp = jsonify([{c: getattr(row, c) for c in campos} for row in rows])
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    if proximo:
+        resp.headers["X-Next-Cursor"] = proximo
+        args = request.args.to_dict()
+        args["cursor"] = proximo
+        resp.headers["Link"] = f'<{url_for("main.api_treinos", **args)}>; rel="next"'
+    return resp
+
+
+@bp.route("/api/gerar_planos_lote", methods=["POST"])
+@login_required
+def api_gerar_planos_lote():
+    """
+    Gera planos em lote. Corpo JSON: {"perfis": [[nivel, objetivo, divisao, dias, peso, altura, idade], ...]}
+    (cada perfil também pode ser um dict com essas chaves). Responde em NDJSON, uma linha por perfil;
+    ?progressao=1 inclui o texto de progressão dos itens.
+    """
+    dados = request.get_json(silent=True)
+    perfis = dados.get("perfis") if isinstance(dados, dict) else dados
+    if not isinstance(perfis, list):
+        return jsonify({"status": "erro", "mensagem": "Envie uma lista de perfis."}), 400
+    if len(perfis) > current_app.config['MAX_PERFIS_LOTE']:
+        return jsonify({"status": "erro", "mensagem": f"Máximo de {current_app.config['MAX_PERFIS_LOTE']} perfis por lote."}), 413
+
+    # valida tudo antes de começar o streaming (depois do primeiro byte não dá pra mudar o status)
+    normalizados = []
+    for i, perfil in enumerate(perfis):
+        try:
+            normalizados.append(normalizar_perfil(perfil))
+        except ValueError as e:
+            return jsonify({"status": "erro", "indice": i, "mensagem": str(e)}), 400
+
+    progressao = request.args.get("progressao") == "1"
+
+    def gerar():
+        for i, plan in enumerate(build_plans(normalizados)):
+            yield current_app.json.dumps({"indice": i, "plan": plano_json(plan, progressao)}) + "\n"
+
+    return Response(stream_with_context(gerar()), mimetype="application/x-ndjson")
+
+
+@bp.route("/metrics")
+def metrics():
+    # se FITPLANNER_METRICS_TOKEN estiver definido, exige "Authorization: Bearer <token>"
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return Response("não autorizado\n", status=401, mimetype="text/plain")
+    return Response(exportar_metricas(), mimetype="text/plain; version=0.0.4")
+
+
+# -------------------------
+# Inicialização do app e dos workers
+# -------------------------
+# O import só monta dados em memória baratos (catálogo, DIVISAO_MAP, progressões) e o `app` padrão;
+# não cria schema nem diretórios. O schema é responsabilidade do `flask --app app migrar-db` (deploy).
+def create_app(config=None):
+    """
+    Monta um app: config das variáveis FITPLANNER_* com o dict `config` por cima, banco (engines
+    e PRAGMAs do SQLite), Flask-Login, JSON, caches próprios e o blueprint com rotas, hooks e
+    comandos do CLI. O módulo cria o `app` padrão no import (`app:app` no gunicorn e no CLI);
+    testes e scripts podem criar outros, cada um com seu banco e seus caches.
+    """
+    app = Flask(__name__)
+    _config_do_ambiente(app)
+    app.config.update(config or {})
+    if app.config['MAX_CONTENT_LENGTH'] is None:
+        app.config['MAX_CONTENT_LENGTH'] = app.config['UPLOAD_MAX_BYTES'] + 1024 * 1024
+
+    sqlite_arquivo = _configurar_banco(app)
+    db.init_app(app)
+    login_manager.init_app(app)
+    if sqlite_arquivo:
+        with app.app_context():
+            event.listen(db.engines[None], "connect", _pragmas_sqlite(app.config, False))
+            if "leitura" in db.engines:
+                event.listen(db.engines["leitura"], "connect", _pragmas_sqlite(app.config, True))
+
+    app.json_provider_class = FitJSONProvider
+    app.json = FitJSONProvider(app)
+    app.extensions["fitplanner"] = EstadoApp(app)
+    _criar_caches(app)
+    app.register_blueprint(bp)
+    return app
+
+
+def carregar_exercicio_ids():
+    """Preenche o cache (nome, grupo) -> id do app atual com a tabela exercicio (se o banco já foi migrado)."""
+    try:
+        rows = db.session.execute(select(Exercicio.id, Exercicio.nome, Exercicio.grupo_muscular)).all()
+    except OperationalError:
+        return
+    finally:
+        db.session.remove()
+    estado = _estado()
+    with estado.exercicio_ids_lock:
+        for row in rows:
+            estado.exercicio_ids[(row.nome, row.grupo_muscular)] = row.id
+
+
+def preparar_pre_fork():
+    """
+    Roda no processo mestre do gunicorn (preload_app) antes dos forks: carrega o que os workers
+    só leem (tabela de esqueletos, ids do catálogo, manifest dos assets) para ser compartilhado
+    por copy-on-write, e fecha as conexões abertas para nenhum worker herdar um socket/arquivo do mestre.
+    """
+    montar_esqueletos()
+    asset_manifest()
+    with app.app_context():
+        carregar_exercicio_ids()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def apos_fork():
+    """Roda em cada worker logo após o fork: descarta (sem fechar) as conexões herdadas do pool."""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+app = create_app()
 
 if __name__ == "__main__":
+    # servidor de desenvolvimento: cria/atualiza o banco antes de subir
+    with app.app_context():
+        migrar_db()
     app.run(debug=True)
\ No newline at end of file
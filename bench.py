@@ -0,0 +1,280 @@
+"""
+Benchmarks do FitPlanner.
+
+Camadas:
+- plan: varre todas as combinações DIVISAO_MAP x objetivo x nível x subconjunto de dias
+  pelo build_plan e mede ops/s, latência p50/p95/p99 e pico de alocação (tracemalloc).
+- http: sobe o app num SQLite temporário com N usuários já com plano salvo e mede as
+  rotas quentes pelo test client do Flask.
+- inicio: mede, em processos novos, o `import app`, o preparar_pre_fork() (o que o mestre do
+  gunicorn faz antes dos forks) e a primeira requisição, e compara o p50 do import com o
+  orçamento --orcamento-import-ms (sai com status 1 se estourar).
+
+Uso:
+    python bench.py                      # plan + http, salva bench_results.json
+    python bench.py plan --repeticoes 3
+    python bench.py http --usuarios 5000 --requisicoes 500
+    python bench.py inicio --rodadas 10 --orcamento-import-ms 800
+    python bench.py --comparar bench_results_antigo.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+OBJETIVOS = ("hipertrofia", "forca", "emagrecimento")
+NIVEIS = ("iniciante", "intermediario", "avancado")
+
+
+def percentis(amostras_ns):
+    """Resumo das latências (em ms) de uma lista de amostras em nanossegundos."""
+    ordenadas = sorted(amostras_ns)
+    n = len(ordenadas)
+
+    def p(q):
+        return ordenadas[min(n - 1, int(q * n))] / 1e6
+
+    total_s = sum(ordenadas) / 1e9
+    return {
+        "n": n,
+        "ops_s": round(n / total_s, 1) if total_s else None,
+        "media_ms": round(statistics.fmean(ordenadas) / 1e6, 4),
+        "p50_ms": round(p(0.50), 4),
+        "p95_ms": round(p(0.95), 4),
+        "p99_ms": round(p(0.99), 4),
+    }
+
+
+def pico_memoria(fn, vezes):
+    """Pico de memória alocada (bytes) durante `vezes` chamadas de fn."""
+    tracemalloc.start()
+    try:
+        for _ in range(vezes):
+            fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def combinacoes_plano(app):
+    dias = app.DIAS_LISTA
+    for divisao in app.DIVISAO_MAP:
+        for objetivo, nivel in itertools.product(OBJETIVOS, NIVEIS):
+            for mascara in range(1 << len(dias)):
+                yield divisao, objetivo, nivel, [d for i, d in enumerate(dias) if mascara >> i & 1]
+
+
+# -------------------------
+# Camada 1: build_plan
+# -------------------------
+def bench_plan(app, repeticoes=1):
+    combos = list(combinacoes_plano(app))
+    amostras, por_divisao = [], {}
+    for rep in range(repeticoes):
+        for i, (divisao, objetivo, nivel, dias) in enumerate(combos):
+            t0 = time.perf_counter_ns()
+            app.build_plan(nivel, objetivo, divisao, dias, 80.0, 1.75, 30, seed=i + rep)
+            dt = time.perf_counter_ns() - t0
+            amostras.append(dt)
+            por_divisao.setdefault(divisao, []).append(dt)
+
+    it = iter(itertools.cycle(combos))
+
+    def um_plano():
+        divisao, objetivo, nivel, dias = next(it)
+        app.build_plan(nivel, objetivo, divisao, dias, 80.0, 1.75, 30, seed=0)
+
+    resultado = percentis(amostras)
+    resultado["combinacoes"] = len(combos)
+    resultado["pico_bytes"] = pico_memoria(um_plano, min(len(combos), 2000))
+    resultado["por_divisao"] = {d: percentis(a) for d, a in por_divisao.items()}
+    return resultado
+
+
+# -------------------------
+# Camada 2: rotas HTTP
+# -------------------------
+def semear_banco(app, usuarios):
+    """Cria `usuarios` contas (mesmo hash de senha, pra não gastar minutos com pbkdf2) com plano salvo."""
+    from sqlalchemy import insert, select
+
+    senha = app.generate_password_hash("bench")
+    combos = list(combinacoes_plano(app))
+    with app.app.app_context():
+        app.migrar_db()
+        app.db.session.execute(insert(app.User), [
+            {"nome": f"Bench {i}", "email": f"bench{i}@fitplanner.test", "senha": senha} for i in range(usuarios)
+        ])
+        app.db.session.commit()
+        ids = [row[0] for row in app.db.session.execute(select(app.User.id).order_by(app.User.id))]
+        for i, user_id in enumerate(ids):
+            divisao, objetivo, nivel, dias = combos[(i * 7919) % len(combos)]
+            plan = app.plano_cacheado(app.normalizar_perfil((nivel, objetivo, divisao, dias or ["Seg"], 80, 1.75, 30)))
+            app.salvar_plano(user_id, plan, modo="substituir")
+    return ids
+
+
+def bench_http(app, requisicoes=200):
+    app.app.config["WTF_CSRF_ENABLED"] = False
+    client = app.app.test_client()
+    resp = client.post("/login", data={"email": "bench0@fitplanner.test", "senha": "bench"})
+    assert resp.status_code == 302, "login do usuário de benchmark falhou"
+
+    formularios = [
+        {"nivel": nivel, "objetivo": objetivo, "divisao": divisao, "dias": dias or ["Seg"],
+         "peso": "80", "altura": "1.75", "idade": "30"}
+        for divisao, objetivo, nivel, dias in itertools.islice(combinacoes_plano(app), 0, None, 37)
+    ]
+    forms = itertools.cycle(formularios)
+    # salvar alterna entre dois perfis, senão o modo diff não grava nada
+    salvar = itertools.cycle(formularios[:2])
+
+    rotas = {
+        "gerar_plano_preview": lambda: client.post("/gerar_plano?preview=1", data=next(forms)),
+        "gerar_plano_salvar": lambda: client.post("/gerar_plano", data=next(salvar)),
+        "dashboard": lambda: client.get("/dashboard"),
+        "api_treinos": lambda: client.get("/api/treinos"),
+        "api_treinos_stats": lambda: client.get("/api/treinos_stats"),
+    }
+    resultados = {}
+    for nome, chamar in rotas.items():
+        chamar()  # aquecimento
+        amostras = []
+        for _ in range(requisicoes):
+            t0 = time.perf_counter_ns()
+            resp = chamar()
+            amostras.append(time.perf_counter_ns() - t0)
+            assert resp.status_code < 400, f"{nome}: HTTP {resp.status_code}"
+        resultados[nome] = percentis(amostras)
+        resultados[nome]["pico_bytes"] = pico_memoria(chamar, min(requisicoes, 50))
+    return resultados
+
+
+# -------------------------
+# Camada 3: inicialização (o que um worker novo paga)
+# -------------------------
+_SCRIPT_INICIO = """
+import time
+t0 = time.perf_counter_ns()
+import app
+t1 = time.perf_counter_ns()
+app.preparar_pre_fork()
+t2 = time.perf_counter_ns()
+resp = app.app.test_client().get("/login")
+t3 = time.perf_counter_ns()
+assert resp.status_code == 200, resp.status_code
+print(t1 - t0, t2 - t1, t3 - t2)
+"""
+
+
+def bench_inicio(rodadas=5, orcamento_import_ms=None):
+    """Cada rodada é um interpretador novo (sem módulos em cache), como um worker recém-criado."""
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    # uma rodada descartada: gera os .pyc e aquece o cache de disco
+    subprocess.run([sys.executable, "-c", _SCRIPT_INICIO], cwd=raiz, check=True, capture_output=True)
+    etapas = ("import", "preparar_pre_fork", "primeira_requisicao")
+    amostras = {etapa: [] for etapa in etapas}
+    for _ in range(rodadas):
+        saida = subprocess.run([sys.executable, "-c", _SCRIPT_INICIO], cwd=raiz, check=True,
+                               capture_output=True, text=True).stdout.split()
+        for etapa, ns in zip(etapas, saida[-3:]):
+            amostras[etapa].append(int(ns))
+    resultado = {etapa: percentis(a) for etapa, a in amostras.items()}
+    if orcamento_import_ms:
+        resultado["orcamento_import_ms"] = orcamento_import_ms
+        resultado["dentro_do_orcamento"] = resultado["import"]["p50_ms"] <= orcamento_import_ms
+    return resultado
+
+
+# -------------------------
+# Saída / comparação
+# -------------------------
+def metadados(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "plataforma": platform.platform(),
+            "data": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)}
+
+
+def comparar(atual, anterior):
+    """Imprime a variação de p50/p95/ops_s entre duas execuções (mesma estrutura de JSON)."""
+    def linhas(a, b, prefixo=""):
+        for chave, valor in a.items():
+            if not isinstance(valor, dict) or chave not in b:
+                continue
+            if "p50_ms" in valor:
+                partes = []
+                for m in ("ops_s", "p50_ms", "p95_ms"):
+                    if valor.get(m) and b[chave].get(m):
+                        partes.append(f"{m} {b[chave][m]} -> {valor[m]} ({(valor[m] / b[chave][m] - 1) * 100:+.1f}%)")
+                print(f"{prefixo}{chave}: " + ", ".join(partes))
+            linhas(valor, b[chave], prefixo + chave + ".")
+
+    print(f"comparando {anterior.get('meta', {}).get('commit')} -> {atual.get('meta', {}).get('commit')}")
+    linhas({k: v for k, v in atual.items() if k != "meta"}, anterior)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("camada", nargs="?", choices=("plan", "http", "inicio", "all"), default="all")
+    parser.add_argument("--repeticoes", type=int, default=1, help="passadas completas pela varredura do build_plan")
+    parser.add_argument("--usuarios", type=int, default=1000, help="usuários com plano no banco semeado")
+    parser.add_argument("--requisicoes", type=int, default=200, help="requisições medidas por rota")
+    parser.add_argument("--rodadas", type=int, default=5, help="processos novos medidos na camada inicio")
+    parser.add_argument("--orcamento-import-ms", type=float, default=1000,
+                        help="p50 máximo aceito para o `import app` (0 desliga a verificação)")
+    parser.add_argument("--saida", default="bench_results.json")
+    parser.add_argument("--comparar", metavar="JSON", help="resultado anterior para comparar")
+    args = parser.parse_args(argv)
+
+    # banco e cache isolados: nunca tocar no instance/ de desenvolvimento
+    tmp = tempfile.mkdtemp(prefix="fitplanner-bench-")
+    os.environ["FITPLANNER_DATABASE_URL"] = "sqlite:///" + os.path.join(tmp, "bench.db")
+    os.environ.setdefault("FITPLANNER_CACHE_PATH", os.path.join(tmp, "cache.db"))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    resultado = {"meta": metadados(args)}
+    if args.camada in ("plan", "all"):
+        resultado["plan"] = bench_plan(app, args.repeticoes)
+        print("build_plan:", {k: v for k, v in resultado["plan"].items() if k != "por_divisao"})
+    if args.camada in ("http", "all"):
+        t0 = time.perf_counter()
+        semear_banco(app, args.usuarios)
+        resultado["semeadura_s"] = round(time.perf_counter() - t0, 2)
+        resultado["http"] = bench_http(app, args.requisicoes)
+        for rota, r in resultado["http"].items():
+            print(f"{rota}: {r}")
+
+    if args.camada in ("inicio", "all"):
+        resultado["inicio"] = bench_inicio(args.rodadas, args.orcamento_import_ms)
+        for etapa, r in resultado["inicio"].items():
+            print(f"inicio.{etapa}: {r}")
+
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"resultados em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(resultado, json.load(f))
+
+    if resultado.get("inicio", {}).get("dentro_do_orcamento") is False:
+        print(f"import acima do orçamento: p50 {resultado['inicio']['import']['p50_ms']} ms "
+              f"> {args.orcamento_import_ms} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
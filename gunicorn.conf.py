@@ -0,0 +1,49 @@
+"""
+Configuração do gunicorn para produção:
+
+    flask --app app migrar-db          # schema (uma vez por deploy)
+    gunicorn -c gunicorn.conf.py
+
+O app é importado uma vez no processo mestre (preload_app) e os workers nascem por fork: o
+catálogo, o DIVISAO_MAP e as progressões saem do import, e o when_ready completa a tabela de
+ESQUELETOS (que fora daqui é preenchida sob demanda). Tudo é compartilhado por copy-on-write,
+então subir um worker novo não refaz esse trabalho.
+"""
+import gc
+import multiprocessing
+import os
+
+wsgi_app = "app:app"
+bind = os.environ.get("FITPLANNER_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("FITPLANNER_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# workers com threads: enquanto algumas threads esperam um hash de senha, as outras atendem o resto
+worker_class = "gthread"
+threads = int(os.environ.get("FITPLANNER_THREADS", 4))
+preload_app = True
+
+# hashes de senha por worker: no máximo threads - 1 requisições presas em hash (rodando + na fila),
+# o excedente recebe 503 na hora e sempre sobra uma thread para as outras rotas
+os.environ.setdefault("FITPLANNER_HASH_FILA_MAX", str(max(1, threads - 1)))
+os.environ.setdefault("FITPLANNER_HASH_WORKERS", str(max(1, min(2, threads - 1))))
+
+# com mais de um worker, os caches (planos, previews, stats, usuários) vão para o SQLite
+# compartilhado: o backend "memory" é um cache por processo e só serve para um worker
+if workers > 1:
+    os.environ.setdefault("FITPLANNER_CACHE_BACKEND", "sqlite")
+
+
+def when_ready(server):
+    # roda no mestre, com o app já importado e antes do primeiro fork
+    import app
+
+    app.preparar_pre_fork()
+    # objetos de longa duração saem das gerações do GC: as coletas nos workers não tocam
+    # (nem copiam, ao atualizar o cabeçalho dos objetos) as páginas herdadas do mestre
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import app
+
+    app.apos_fork()
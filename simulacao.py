@@ -0,0 +1,195 @@
+"""
+Simulação vetorizada de planos para populações inteiras (planejamento de capacidade e análises).
+
+Em vez de chamar build_plan perfil a perfil, recebe arrays de perfis e gera os planos em lotes com
+operações NumPy. A saída é colunar (um array por coluna, uma linha por exercício prescrito).
+
+Segue as mesmas regras do build_plan: multiplicador por nível/IMC/idade, séries por aparição a partir
+do VOLUME_ALVO, compostos antes de isolamentos, faixas de séries/reps por objetivo e nenhum exercício
+repetido na semana. É estatisticamente equivalente, não idêntico: os sorteios usam o gerador do NumPy,
+e na alternância Perna A/B cada bloco só avança (não há a etapa de "extras" do catálogo de pernas).
+
+Requer numpy (não é dependência do app web): pip install numpy
+"""
+import numpy as np
+
+from app import (CATALOGO, DIVISAO_MAP, DIVISOES_PERNA_AB, EXPANSAO_GRUPOS, MASCARA_PADRAO, MULT_POR_NIVEL,
+                 PARAMS_OBJETIVO, VOLUME_ALVO, esqueleto_plano)
+
+NIVEIS = ("iniciante", "intermediario", "avancado")
+OBJETIVOS = ("hipertrofia", "forca", "emagrecimento")
+DIVISOES = tuple(DIVISAO_MAP)
+
+_MULT = np.array([MULT_POR_NIVEL[n] for n in NIVEIS])
+# [objetivo, 0=composto/1=isolamento, 0=min/1=max]
+_SETS = np.array([[PARAMS_OBJETIVO[o][2], PARAMS_OBJETIVO[o][3]] for o in OBJETIVOS])
+_REPS = np.array([[PARAMS_OBJETIVO[o][0], PARAMS_OBJETIVO[o][1]] for o in OBJETIVOS])
+
+# por exercício do catálogo (índice = ExercicioDef.id)
+GRUPOS = tuple(CATALOGO.por_grupo)
+EX_GRUPO = np.array([GRUPOS.index(e.grupo) for e in CATALOGO.exercicios], dtype=np.int8)
+EX_ISOLAMENTO = np.array([e.tipo == "isolamento" for e in CATALOGO.exercicios], dtype=np.int8)
+
+
+def _ids(exercicios):
+    return np.array([e.id for e in exercicios], dtype=np.int16)
+
+
+# candidatos na ordem em que o build_plan os consome: (ids, é_isolamento, cap de séries)
+_CANDIDATOS_GRUPO = {
+    g: ((_ids(CATALOGO.por_grupo_tipo.get((g, "composto"), ())), 0, None),
+        (_ids(CATALOGO.por_grupo_tipo.get((g, "isolamento"), ())), 1, None))
+    for g in CATALOGO.por_grupo
+}
+_CANDIDATOS_PERNA = {
+    usar_a: ((_ids([e for e in bloco if e.tipo == "composto"]), 0, 3),
+             (_ids([e for e in bloco if e.tipo == "isolamento"]), 1, None))
+    for usar_a, bloco in ((True, CATALOGO.perna_a), (False, CATALOGO.perna_b))
+}
+
+
+def codificar(valores, vocabulario):
+    """Converte uma sequência de strings (ex.: níveis) em códigos inteiros do vocabulário."""
+    indice = {v: i for i, v in enumerate(vocabulario)}
+    return np.array([indice[v] for v in valores], dtype=np.int8)
+
+
+def mascara_dias(dias):
+    """["Seg", "Qua"] -> 0b0000101"""
+    from app import DIA_INDEX
+    m = 0
+    for d in dias:
+        m |= 1 << DIA_INDEX[d]
+    return m
+
+
+def multiplicadores(nivel, peso, altura, idade):
+    """Multiplicador de volume por perfil (nível, IMC > 32 e idade > 55), vetorizado."""
+    altura = np.asarray(altura, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        imc = np.where(altura > 0, np.asarray(peso, dtype=np.float64) / altura ** 2, 0.0)
+    mult = _MULT[np.asarray(nivel)]
+    mult = mult * np.where(imc > 32, 0.9, 1.0)
+    return mult * np.where(np.asarray(idade) > 55, 0.9, 1.0)
+
+
+def _esqueleto(divisao, mascara):
+    """Grupos de cada dia da semana (tabela ESQUELETOS do app): [(dia_idx, (grupo, ...)), ...]."""
+    esq = esqueleto_plano(divisao, mascara, 1.0)
+    return list(zip(esq.dias, esq.day_patterns))
+
+
+def _simular_esqueleto(rng, divisao, esqueleto, perfis, objetivo, mult, saida):
+    """Gera os planos de todos os perfis que compartilham o mesmo esqueleto (divisão + dias)."""
+    p = len(perfis)
+    aparicoes = {}
+    for _, grupos in esqueleto:
+        for g in grupos:
+            aparicoes[g] = aparicoes.get(g, 0) + 1
+    necessarias = {}
+    for g, freq in aparicoes.items():
+        alvo = VOLUME_ALVO.get(g, (6, 10))
+        alvo_media = int(round((alvo[0] + alvo[1]) / 2.0))
+        # np.round arredonda metades para o par, igual ao round() do Python
+        necessarias[g] = np.maximum(2, np.round(alvo_media / freq * mult)).astype(np.int64)
+
+    faixa_sets = _SETS[objetivo]  # (p, 2 tipos, 2)
+    ponteiros = {}
+    alterna_perna = divisao in DIVISOES_PERNA_AB
+    perna_toggle = 0
+    for dia, grupos in esqueleto:
+        for grupo_dia in grupos:
+            for g in EXPANSAO_GRUPOS.get(grupo_dia, (grupo_dia,)):
+                restante = necessarias[g].copy() if g in necessarias else np.full(p, 3, dtype=np.int64)
+                if g == "Pernas" and alterna_perna:
+                    chave, candidatos = ("perna", perna_toggle % 2 == 0), _CANDIDATOS_PERNA[perna_toggle % 2 == 0]
+                    perna_toggle += 1
+                else:
+                    chave, candidatos = g, _CANDIDATOS_GRUPO.get(g, ())
+                for k, (ids, iso, cap) in enumerate(candidatos):
+                    ponteiro = ponteiros.setdefault((chave, k), np.zeros(p, dtype=np.int64))
+                    lo, hi = faixa_sets[:, iso, 0], faixa_sets[:, iso, 1]
+                    for _ in range(len(ids)):
+                        ativo = (restante > 0) & (ponteiro < len(ids))
+                        if not ativo.any():
+                            break
+                        series = np.maximum(1, np.ceil(rng.integers(lo, hi + 1) * mult)).astype(np.int64)
+                        if cap is not None:
+                            series = np.minimum(series, cap)
+                        saida.append((perfis[ativo], np.full(int(ativo.sum()), dia, dtype=np.int8),
+                                      ids[ponteiro[ativo]], series[ativo]))
+                        restante -= np.where(ativo, series, 0)
+                        ponteiro += ativo
+
+
+def simular_lote(nivel, objetivo, divisao, dias, peso, altura, idade, rng=None, offset=0):
+    """
+    Simula um lote de perfis. Todos os argumentos são arrays do mesmo tamanho:
+    nivel/objetivo/divisao em códigos (ver NIVEIS, OBJETIVOS, DIVISOES e codificar()),
+    dias como máscara de 7 bits (bit 0 = Seg; 0 usa Seg/Qua/Sex), peso/altura/idade numéricos.
+    Retorna dict colunar: perfil, dia, exercicio, grupo, series, repeticoes (um item por linha),
+    ordenado por perfil, dia e compostos antes de isolamentos. `perfil` soma `offset`.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    nivel, objetivo, divisao = (np.asarray(a, dtype=np.int64) for a in (nivel, objetivo, divisao))
+    dias = np.asarray(dias, dtype=np.int64)
+    dias = np.where(dias & 0x7F, dias & 0x7F, MASCARA_PADRAO)
+    mult = multiplicadores(nivel, peso, altura, idade)
+
+    saida = []
+    # perfis com a mesma divisão e os mesmos dias compartilham o esqueleto da semana
+    chaves = divisao * 128 + dias
+    ordem = np.argsort(chaves, kind="stable")
+    unicas, inicios = np.unique(chaves[ordem], return_index=True)
+    for chave, perfis in zip(unicas, np.split(ordem, inicios[1:])):
+        nome_divisao = DIVISOES[int(chave) // 128]
+        esqueleto = _esqueleto(nome_divisao, int(chave) % 128)
+        _simular_esqueleto(rng, nome_divisao, esqueleto, perfis, objetivo[perfis], mult[perfis], saida)
+
+    if not saida:
+        vazio = np.zeros(0, dtype=np.int16)
+        return {"perfil": vazio.astype(np.int64), "dia": vazio.astype(np.int8), "exercicio": vazio,
+                "grupo": vazio.astype(np.int8), "series": vazio, "repeticoes": vazio}
+    perfil = np.concatenate([s[0] for s in saida])
+    dia = np.concatenate([s[1] for s in saida])
+    exercicio = np.concatenate([s[2] for s in saida])
+    series = np.concatenate([s[3] for s in saida]).astype(np.int16)
+
+    # reps: sorteio na faixa do objetivo/tipo; iniciantes puxam para o topo da faixa; limite 3..20
+    iso = EX_ISOLAMENTO[exercicio]
+    faixa = _REPS[objetivo[perfil], iso]
+    reps = rng.integers(faixa[:, 0], faixa[:, 1] + 1)
+    iniciante = nivel[perfil] == 0
+    reps = np.where(iniciante, np.floor(np.minimum(reps * 1.1, faixa[:, 1])), reps)
+    reps = np.clip(reps, 3, 20).astype(np.int16)
+
+    ordem = np.lexsort((iso, dia, perfil))
+    return {
+        "perfil": perfil[ordem] + offset,
+        "dia": dia[ordem],
+        "exercicio": exercicio[ordem],
+        "grupo": EX_GRUPO[exercicio[ordem]],
+        "series": series[ordem],
+        "repeticoes": reps[ordem],
+    }
+
+
+def simular_populacao(nivel, objetivo, divisao, dias, peso, altura, idade, lote=200_000, seed=None):
+    """
+    Gera os planos de uma população em lotes de `lote` perfis (é um gerador de dicts colunares,
+    um por lote), para que centenas de milhares de perfis não precisem caber de uma vez na memória.
+    Mesmo `seed` -> mesma simulação.
+    """
+    rng = np.random.default_rng(seed)
+    arrays = [np.asarray(a) for a in (nivel, objetivo, divisao, dias, peso, altura, idade)]
+    total = len(arrays[0])
+    for inicio in range(0, total, lote):
+        fatia = slice(inicio, inicio + lote)
+        yield simular_lote(*(a[fatia] for a in arrays), rng=rng, offset=inicio)
+
+
+def volume_por_grupo(colunas, n_perfis):
+    """Matriz (n_perfis, len(GRUPOS)) com as séries semanais de cada perfil por grupo muscular."""
+    volume = np.zeros((n_perfis, len(GRUPOS)), dtype=np.int64)
+    np.add.at(volume, (colunas["perfil"], colunas["grupo"]), colunas["series"])
+    return volume
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as fitplanner  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """App novo, com banco e caches num diretório temporário, já migrado."""
+    app = fitplanner.create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'fitplanner.db'}",
+        "CACHE_PATH": str(tmp_path / "cache.db"),
+    })
+    with app.app_context():
+        fitplanner.migrar_db()
+    return app
+
+
+@pytest.fixture
+def entrar(app):
+    """entrar(email) -> test client já cadastrado e logado com esse email."""
+    def entrar(email="ana@fitplanner.test"):
+        client = app.test_client()
+        client.post("/register", data={"nome": "Ana", "email": email, "senha": "segredo"})
+        resp = client.post("/login", data={"email": email, "senha": "segredo"})
+        assert resp.status_code == 302
+        return client
+    return entrar
@@ -0,0 +1,57 @@
+"""/api/treinos: paginação por cursor e GET condicional pela versão do plano."""
+FORM = {"nivel": "intermediario", "objetivo": "hipertrofia", "peso": "80", "altura": "1.8", "idade": "30"}
+
+
+def _salvar(client, divisao, dias):
+    resp = client.post("/gerar_plano", data=dict(FORM, divisao=divisao, dias=dias))
+    assert resp.status_code == 302
+
+
+def test_paginacao_por_cursor_sem_buracos_nem_repeticoes(entrar):
+    client = entrar()
+    # dois planos seguidos no modo diff: os ids novos caem em dias já ocupados, então a ordem
+    # (dia, id) não acompanha a ordem dos ids
+    _salvar(client, "ppl", ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb"])
+    _salvar(client, "upperlower", ["Seg", "Qua", "Sex", "Sáb"])
+    completo = client.get("/api/treinos").get_json()
+    assert len(completo) > 20
+    assert [(t["dia"], t["id"]) for t in completo] == sorted((t["dia"], t["id"]) for t in completo)
+
+    paginas, url = [], "/api/treinos?limit=7&fields=id,dia"
+    while url:
+        resp = client.get(url)
+        assert resp.status_code == 200
+        pagina = resp.get_json()
+        assert 1 <= len(pagina) <= 7
+        paginas.append(pagina)
+        cursor = resp.headers.get("X-Next-Cursor")
+        if cursor:
+            assert f"cursor={cursor}" in resp.headers["Link"]
+            url = f"/api/treinos?limit=7&fields=id,dia&cursor={cursor}"
+        else:
+            url = None
+    ids = [t["id"] for pagina in paginas for t in pagina]
+    assert ids == [t["id"] for t in completo]
+    assert len(ids) == len(set(ids))
+    assert all(len(pagina) == 7 for pagina in paginas[:-1])
+
+
+def test_if_none_match_responde_304_ate_o_plano_mudar(entrar):
+    client = entrar()
+    _salvar(client, "abc", ["Seg", "Qua", "Sex"])
+    resp = client.get("/api/treinos")
+    etag = resp.headers["ETag"]
+    assert resp.status_code == 200 and etag
+
+    resp = client.get("/api/treinos", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.headers["ETag"] == etag
+    assert not resp.data
+    # a resposta comprimida leva o ETag fraco; ele também vale
+    assert client.get("/api/treinos", headers={"If-None-Match": "W/" + etag}).status_code == 304
+
+    _salvar(client, "ppl", ["Seg", "Qua", "Sex"])
+    resp = client.get("/api/treinos", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+    assert client.get("/api/treinos", headers={"If-None-Match": resp.headers["ETag"]}).status_code == 304
@@ -0,0 +1,28 @@
+"""create_app: cada app tem a própria config, banco e caches."""
+import app as fitplanner
+
+
+def test_config_sobrescreve_o_ambiente(app):
+    assert app.config["TESTING"]
+    assert app.config["MAX_CONTENT_LENGTH"] == app.config["UPLOAD_MAX_BYTES"] + 1024 * 1024
+    outro = fitplanner.create_app({"UPLOAD_MAX_BYTES": 1024, "CACHE_BACKEND": "sqlite"})
+    assert outro.config["MAX_CONTENT_LENGTH"] == 1024 + 1024 * 1024
+    assert type(outro.extensions["fitplanner"].caches["planos"]).__name__ == "SQLiteCache"
+    assert type(app.extensions["fitplanner"].caches["planos"]).__name__ == "MemoryCache"
+
+
+def test_apps_nao_compartilham_banco_nem_caches(app, entrar, tmp_path):
+    client = entrar()
+    assert client.get("/dashboard").status_code == 200
+
+    outro = fitplanner.create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'outro.db'}",
+        "CACHE_PATH": str(tmp_path / "outro-cache.db"),
+    })
+    with outro.app_context():
+        fitplanner.migrar_db()
+        assert fitplanner.db.session.query(fitplanner.User).count() == 0
+        assert len(fitplanner.user_cache) == 0
+    with app.app_context():
+        assert fitplanner.db.session.query(fitplanner.User).count() == 1
+        assert len(fitplanner.user_cache) == 1
@@ -0,0 +1,73 @@
+"""
+Saída do build_plan com seed fixa. O motor foi reescrito várias vezes por desempenho
+(catálogo indexado, seleção por conjuntos, tabela de esqueletos) e a promessa é que a
+saída continue idêntica à do gerador original para a mesma seed; estes testes seguram isso.
+
+O digest foi calculado com o build_plan original (random.seed(n) + build_plan(...)) e bate
+com o atual usando build_plan(..., seed=n).
+"""
+import hashlib
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+DIVISOES = ("livre", "abc", "abcd", "abcde", "ppl", "upperlower", "ppl_ul", "desconhecida")
+OBJETIVOS = ("hipertrofia", "forca", "emagrecimento", None)
+NIVEIS = ("iniciante", "intermediario", "avancado", "desconhecido")
+CORPOS = ((80, 1.8, 30), (120, 1.7, 60), (0, 0, 0))  # normal, IMC alto + idade > 55, sem dados
+
+DIGEST_VARREDURA = "0abcfc84d8abe2c970ebb2bb9ee959940cd1f7d9225ef0f8ff2b11b373261bff"
+
+
+def test_plano_ppl_forca_seed_1():
+    plan = app.build_plan("intermediario", "forca", "ppl", ["Seg", "Qua", "Sex"], 80, 1.8, 30, seed=1)
+    assert [(it["dia"], it["grupo"], it["exercicio"], it["series"], it["repeticoes"]) for it in plan] == [
+        ("Seg", "Peito", "Supino reto", 4, 5),
+        ("Seg", "Peito", "Supino inclinado", 6, 3),
+        ("Seg", "Peito", "Flexão de braço", 4, 6),
+        ("Seg", "Ombro", "Desenvolvimento militar", 5, 6),
+        ("Seg", "Ombro", "Remada alta", 5, 4),
+        ("Seg", "Tríceps", "Paralelas", 4, 6),
+        ("Seg", "Tríceps", "Tríceps corda", 3, 7),
+        ("Seg", "Tríceps", "Tríceps testa", 2, 8),
+        ("Qua", "Costas", "Levantamento terra", 4, 5),
+        ("Qua", "Costas", "Puxada alta", 6, 4),
+        ("Qua", "Costas", "Remada curvada", 5, 3),
+        ("Qua", "Bíceps", "Rosca direta", 3, 8),
+        ("Qua", "Bíceps", "Rosca alternada", 2, 4),
+        ("Qua", "Bíceps", "Rosca martelo", 2, 7),
+        ("Qua", "Bíceps", "Rosca scott", 2, 5),
+        ("Sex", "Pernas", "Agachamento livre", 3, 6),
+        ("Sex", "Pernas", "Leg press 45°", 3, 6),
+        ("Sex", "Pernas", "Hack machine", 3, 4),
+        ("Sex", "Pernas", "Passada com halteres", 3, 5),
+        ("Sex", "Pernas", "Agachamento búlgaro", 3, 4),
+        ("Sex", "Core", "Farmer's walk (caminhada)", 6, 4),
+    ]
+
+
+def test_mesma_seed_mesmo_plano():
+    args = ("avancado", "hipertrofia", "upperlower", ["Seg", "Ter", "Qui", "Sex"], 90, 1.75, 40)
+    assert app.build_plan(*args, seed=7) == app.build_plan(*args, seed=7)
+
+
+def test_varredura_identica_ao_gerador_original():
+    # todas as divisões x objetivos x níveis x 128 combinações de dias, com seed = índice
+    digest = hashlib.sha256()
+    n = 0
+    for divisao in DIVISOES:
+        for objetivo in OBJETIVOS:
+            for nivel in NIVEIS:
+                for mascara in range(1 << len(app.DIAS_LISTA)):
+                    dias = [d for i, d in enumerate(app.DIAS_LISTA) if mascara >> i & 1]
+                    peso, altura, idade = CORPOS[n % len(CORPOS)]
+                    plan = app.build_plan(nivel, objetivo, divisao, dias, peso, altura, idade, seed=n)
+                    itens = [sorted(dict(item).items()) for item in plan]
+                    digest.update(json.dumps(itens, ensure_ascii=False).encode())
+                    n += 1
+    assert n == 16384
+    assert digest.hexdigest() == DIGEST_VARREDURA
@@ -0,0 +1,71 @@
+"""migrar_db sobre um banco no schema original (treino com nome/grupo do exercício em cada linha)."""
+import sqlite3
+
+from sqlalchemy import select
+
+import app as fitplanner
+
+SCHEMA_ORIGINAL = """
+CREATE TABLE user (
+    id INTEGER NOT NULL, nome VARCHAR(100), email VARCHAR(120) NOT NULL, senha VARCHAR(200) NOT NULL,
+    foto VARCHAR(200), theme VARCHAR(20), PRIMARY KEY (id), UNIQUE (email)
+);
+CREATE TABLE treino (
+    id INTEGER NOT NULL, user_id INTEGER, dias_semana_id INTEGER, grupo_muscular VARCHAR(120),
+    exercicio VARCHAR(120), series INTEGER, repeticoes INTEGER,
+    PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id)
+);
+"""
+
+TREINOS = [
+    (1, 1, 0, "Peito", "Supino reto", 4, 8),
+    (2, 1, 0, "Peito", "Supino reto", 3, 10),   # mesmo exercício duas vezes
+    (5, 1, 2, "Costas", "Puxada alta", 4, 10),
+    (7, 2, 4, None, "Exercício da casa", 3, 15),  # fora do catálogo e sem grupo
+]
+
+
+def test_migra_banco_original_preservando_os_dados(tmp_path):
+    caminho = tmp_path / "antigo.db"
+    conn = sqlite3.connect(caminho)
+    conn.executescript(SCHEMA_ORIGINAL)
+    conn.executemany("INSERT INTO user (id, nome, email, senha, theme) VALUES (?, ?, ?, ?, ?)",
+                     [(1, "Ana", "ana@fitplanner.test", "hash-1", "dark"), (2, "Bia", "bia@fitplanner.test", "hash-2", "light")])
+    conn.executemany("INSERT INTO treino VALUES (?, ?, ?, ?, ?, ?, ?)", TREINOS)
+    conn.commit()
+    conn.close()
+
+    app = fitplanner.create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{caminho}",
+                                 "CACHE_PATH": str(tmp_path / "cache.db")})
+    with app.app_context():
+        fitplanner.migrar_db()
+        fitplanner.migrar_db()  # idempotente
+
+    conn = sqlite3.connect(caminho)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == fitplanner.SCHEMA_VERSION == 2
+        colunas_treino = {row[1] for row in conn.execute("PRAGMA table_info(treino)")}
+        assert colunas_treino == {"id", "user_id", "dias_semana_id", "exercicio_id", "series", "repeticoes"}
+        assert "plano_versao" in {row[1] for row in conn.execute("PRAGMA table_info(user)")}
+        indices = {row[1] for row in conn.execute("PRAGMA index_list(treino)")}
+        assert "ix_treino_user_dia" in indices
+        assert [row[2] for row in conn.execute("PRAGMA index_info(ix_treino_user_dia)")] == ["user_id", "dias_semana_id"]
+        assert not conn.execute("SELECT name FROM sqlite_master WHERE name = 'treino_legado'").fetchall()
+
+        assert conn.execute("SELECT id, nome, email, senha, theme, plano_versao FROM user ORDER BY id").fetchall() == [
+            (1, "Ana", "ana@fitplanner.test", "hash-1", "dark", 0),
+            (2, "Bia", "bia@fitplanner.test", "hash-2", "light", 0),
+        ]
+        # catálogo semeado uma vez só, mais o exercício que só existia no treino
+        n_exercicios = conn.execute("SELECT COUNT(*) FROM exercicio").fetchone()[0]
+        assert n_exercicios == len(fitplanner.CATALOGO.exercicios) + 1
+    finally:
+        conn.close()
+
+    with app.app_context():
+        rows = fitplanner.db.session.execute(select(fitplanner.Treino).order_by(fitplanner.Treino.id)).scalars().all()
+        assert [(t.id, t.user_id, t.dias_semana_id, t.grupo_muscular, t.exercicio, t.series, t.repeticoes)
+                for t in rows] == [
+            (i, u, d, g or "", e, s, r) for i, u, d, g, e, s, r in TREINOS
+        ]
+        assert rows[0].exercicio_id == rows[1].exercicio_id
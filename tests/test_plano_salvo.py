@@ -0,0 +1,91 @@
+"""Gravação e edições pontuais do plano salvo (salvar_plano, regenerar_trecho)."""
+import app as fitplanner
+
+FORM_PPL = {"nivel": "intermediario", "objetivo": "hipertrofia", "divisao": "ppl",
+            "dias": ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb"], "peso": "80", "altura": "1.8", "idade": "30"}
+
+
+def _pernas_por_dia(app):
+    with app.app_context():
+        rows, defs = fitplanner._treinos_salvos(1)
+    dias = {}
+    for row, e in zip(rows, defs):
+        if row.grupo_muscular == "Pernas":
+            dias.setdefault(row.dias_semana_id, []).append((e, row.series))
+    return dias
+
+
+def _confere_bloco(pernas, bloco):
+    nomes = {e.nome for e, _ in pernas}
+    assert len(pernas) >= fitplanner.MIN_EXS_PER_PERNA
+    # o bloco do dia abre a lista de compostos, sempre com no máximo 3 séries cada
+    assert next(e for e in bloco if e.tipo == "composto").nome in nomes
+    assert all(series <= 3 for e, series in pernas if e in bloco and e.tipo == "composto")
+    outro = fitplanner.CATALOGO.perna_b if bloco is fitplanner.CATALOGO.perna_a else fitplanner.CATALOGO.perna_a
+    assert not nomes & {e.nome for e in outro}
+
+
+def test_regenerar_dia_de_perna_mantem_bloco_teto_e_minimo(app, entrar):
+    client = entrar()
+    client.post("/gerar_plano", data=FORM_PPL)
+    qua, sab = fitplanner.DIA_INDEX["Qua"], fitplanner.DIA_INDEX["Sáb"]
+    antes = _pernas_por_dia(app)
+    assert sorted(antes) == [qua, sab]
+
+    for _ in range(3):
+        resp = client.post("/plano/dia/Sáb/regenerar", data=FORM_PPL)
+        assert resp.status_code == 200, resp.get_json()
+        depois = _pernas_por_dia(app)
+        assert depois[qua] == antes[qua]
+        _confere_bloco(depois[sab], fitplanner.CATALOGO.perna_b)
+
+    # o grupo inteiro: cada dia de perna continua com o seu bloco (Qua = A, Sáb = B)
+    assert client.post("/plano/grupo/Pernas/regenerar", data=FORM_PPL).status_code == 200
+    depois = _pernas_por_dia(app)
+    _confere_bloco(depois[qua], fitplanner.CATALOGO.perna_a)
+    _confere_bloco(depois[sab], fitplanner.CATALOGO.perna_b)
+
+
+def _item(dia, exercicio, grupo, series, repeticoes):
+    return {"dia": dia, "exercicio": exercicio, "grupo": grupo, "series": series, "repeticoes": repeticoes}
+
+
+def _linhas(user_id):
+    rows, _ = fitplanner._treinos_salvos(user_id)
+    return {(fitplanner.DIAS_LISTA[r.dias_semana_id], r.nome): (r.id, r.series, r.repeticoes) for r in rows}
+
+
+def _versao(user_id):
+    return fitplanner.db.session.get(fitplanner.User, user_id).plano_versao
+
+
+def test_salvar_plano_diff_so_mexe_no_que_mudou(app, entrar):
+    entrar()
+    with app.app_context():
+        fitplanner.salvar_plano(1, [
+            _item("Seg", "Supino reto", "Peito", 4, 8),
+            _item("Seg", "Crucifixo", "Peito", 3, 12),
+            _item("Qua", "Puxada alta", "Costas", 4, 10),
+        ], modo="diff")
+        antes, versao = _linhas(1), _versao(1)
+
+        novo = [
+            _item("Seg", "Supino reto", "Peito", 4, 8),        # igual
+            _item("Seg", "Crucifixo", "Peito", 4, 10),         # séries/reps mudaram
+            _item("Sex", "Agachamento livre", "Pernas", 3, 8),  # nova; Puxada alta saiu
+        ]
+        assert fitplanner.salvar_plano(1, novo, modo="diff") == {"inseridas": 1, "atualizadas": 1, "removidas": 1}
+        fitplanner.db.session.expire_all()
+        depois = _linhas(1)
+        assert depois[("Seg", "Supino reto")] == antes[("Seg", "Supino reto")]
+        assert depois[("Seg", "Crucifixo")] == (antes[("Seg", "Crucifixo")][0], 4, 10)
+        assert ("Qua", "Puxada alta") not in depois
+        assert fitplanner.db.session.query(fitplanner.Treino).filter_by(user_id=1).count() == 3
+        assert set(depois) == {("Seg", "Supino reto"), ("Seg", "Crucifixo"), ("Sex", "Agachamento livre")}
+        assert _versao(1) == versao + 1
+
+        # o mesmo plano de novo não grava nada nem muda a versão
+        assert fitplanner.salvar_plano(1, novo, modo="diff") == {"inseridas": 0, "atualizadas": 0, "removidas": 0}
+        fitplanner.db.session.expire_all()
+        assert _linhas(1) == depois
+        assert _versao(1) == versao + 1
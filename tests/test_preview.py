@@ -0,0 +1,42 @@
+"""Pré-visualização -> confirmar: o token grava o plano mostrado, uma vez, e só para o dono."""
+FORM = {"nivel": "avancado", "objetivo": "forca", "divisao": "abc", "dias": ["Seg", "Qua", "Sex"],
+        "peso": "80", "altura": "1.8", "idade": "30"}
+
+
+def _preview(client):
+    resp = client.post("/gerar_plano?preview=1", data=FORM)
+    assert resp.status_code == 200
+    dados = resp.get_json()
+    return dados["token"], [(it["dia"], it["exercicio"], it["series"], it["repeticoes"]) for it in dados["plan"]]
+
+
+def _salvos(client):
+    dias = ("Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom")
+    return [(dias[t["dia"]], t["exercicio"], t["series"], t["repeticoes"]) for t in client.get("/api/treinos").get_json()]
+
+
+def test_token_grava_o_plano_mostrado_uma_vez_so(entrar):
+    client = entrar()
+    token, plano = _preview(client)
+
+    resp = client.post("/gerar_plano/confirmar", data={"token": token})
+    assert resp.status_code == 302 and resp.headers["Location"].endswith("/dashboard")
+    assert sorted(_salvos(client)) == sorted(plano)
+
+    resp = client.post("/gerar_plano/confirmar", data={"token": token})
+    assert resp.status_code == 302 and resp.headers["Location"].endswith("/gerador")
+
+
+def test_token_de_outro_usuario_e_recusado(entrar):
+    dono = entrar("dono@fitplanner.test")
+    outro = entrar("outro@fitplanner.test")
+    token, plano = _preview(dono)
+
+    resp = outro.post("/gerar_plano/confirmar", data={"token": token})
+    assert resp.status_code == 302 and resp.headers["Location"].endswith("/gerador")
+    assert _salvos(outro) == []
+
+    # a tentativa do outro não consome o token do dono
+    resp = dono.post("/gerar_plano/confirmar", data={"token": token})
+    assert resp.status_code == 302 and resp.headers["Location"].endswith("/dashboard")
+    assert sorted(_salvos(dono)) == sorted(plano)